@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,11 +45,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.db.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.backends.ProfileSessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,14 +81,73 @@ WSGI_APPLICATION = 'bill_id.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Configured from the environment, defaults to a local SQLite database.
+# DATABASE_REPLICA_HOSTS is a comma separated list of read replicas that take
+# the reads of GET requests, see core.db.PrimaryReplicaRouter.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'django.db.backends.sqlite3')
+
+
+def database(host=None):
+    config = {
+        'ENGINE': DATABASE_ENGINE,
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        # Used natively from Django 4.1, core.db pings connections before that
+        'CONN_HEALTH_CHECKS': os.environ.get('DATABASE_CONN_HEALTH_CHECKS', '1') == '1',
+    }
+    if DATABASE_ENGINE == 'django.db.backends.sqlite3':
+        config['NAME'] = os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3')
+        config['OPTIONS'] = {'timeout': int(os.environ.get('SQLITE_TIMEOUT', 5))}
+        # A file rather than the in-memory default, so tests can hit it from several threads.
+        config['TEST'] = {'NAME': os.environ.get('DATABASE_TEST_NAME', BASE_DIR / 'test_db.sqlite3')}
+        return config
+
+    config.update({
+        'NAME': os.environ.get('DATABASE_NAME', 'bill_id'),
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': host or os.environ.get('DATABASE_HOST', ''),
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+    })
+    return config
+
+
 DATABASES = {
+    'default': database(),
+}
+
+for number, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = dict(database(host.strip()), TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['core.db.PrimaryReplicaRouter']
+
+# Applied to every new SQLite connection, see core.db
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': int(os.environ.get('SQLITE_TIMEOUT', 5)) * 1000,
+    'synchronous': 'NORMAL',
+}
+
+AUTH_USER_MODEL = 'core.User'
+
+AUTHENTICATION_BACKENDS = [
+    'core.backends.ProfileModelBackend',
+]
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bill-id',
     }
 }
 
-AUTH_USER_MODEL = 'core.User'
+# Merchant/customer detail responses are cached per object in this cache
+DETAIL_CACHE_ALIAS = 'default'
+DETAIL_CACHE_TIMEOUT = 300
 
 
 # Password validation
@@ -135,11 +198,52 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
+        'core.authentication.ApiKeyAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
 }
 
+# Merchant/customer list endpoints
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+# Idempotency-Key support on the transaction endpoint
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_CACHE_SIZE = 1024
+
+# Largest batch accepted by /api/transactions/bulk/
+BULK_TRANSACTION_MAX_ITEMS = 1000
+
+# Bulk account import, ACCOUNT_IMPORT_WORKERS defaults to the CPU count, 0 hashes passwords in process
+ACCOUNT_IMPORT_BATCH_SIZE = 1000
+ACCOUNT_IMPORT_WORKERS = None
+
+# Token authentication, principals are cached in process for API_KEY_CACHE_TTL seconds
+API_KEY_CACHE_TTL = 60
+API_KEY_CACHE_SIZE = 10000
+
+# /api/stats/ counters are spread over STATS_SHARDS rows to avoid lock contention
+STATS_SHARDS = 8
+STATS_TOP_MERCHANTS = 10
+STATS_MAX_TOP_MERCHANTS = 100
+
+# Requests making more queries than this are logged by core.metrics.MetricsMiddleware
+METRICS_QUERY_BUDGET = 20
+
+# Pre-rendered OpenAPI documents, see manage.py generate_schema
+SCHEMA_CACHE_DIR = BASE_DIR / '.schema_cache'
+
+# Credit merchants from the PendingCredit outbox with manage.py run_settlement instead of in the request
+ASYNC_SETTLEMENT = os.environ.get('ASYNC_SETTLEMENT', '0') == '1'
+SETTLEMENT_BATCH_SIZE = 500
+SETTLEMENT_INTERVAL = 1.0
+SETTLEMENT_WORKERS = 1
+
+# Admin changelists of tables estimated above this many rows show the estimate instead of a COUNT(*)
+ADMIN_COUNT_ESTIMATE_THRESHOLD = 100000
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
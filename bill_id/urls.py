@@ -1,24 +1,19 @@
 from django.contrib import admin
 from django.urls import path
 from django.urls.conf import include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from django.http import JsonResponse
 from core import urls as core_urls
+from core.metrics import metrics_view
+from core.schema import CachedSchemaView
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title='Bill Indonesia Interview Test',
-      default_version='v1',
-      description='REST API for Bill Indonesia Interview Test',
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
+def health(request):
+    return JsonResponse({"status": "ok"})
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('metrics', metrics_view),
+    path('', health),
+    path('docs/', CachedSchemaView.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('api/', include([
         path('', include(core_urls.urlpatterns), name='Core API')
     ]))
@@ -0,0 +1,58 @@
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework import views
+
+from core.permissions import IsStaffOrReadOnly
+from core import provisioning
+
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+}
+
+class AccountBulkCreate(views.APIView):
+    permission_classes = [IsStaffOrReadOnly,]
+
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_STRING,
+            description="CSV with a username,password,role[,balance] header, or one JSON object per line",
+        ),
+        responses={
+            201: "Import Summary With Created Count, Errors And Throughput",
+            400: "Request Body Isn't UTF-8",
+            403: "Staff Account is Required",
+            415: "Content-Type Must Be text/csv Or application/x-ndjson",
+        }
+    )
+    def post(self, request):
+        """
+        Bulk Create Merchants And Customers
+
+        Send the accounts as the raw request body, text/csv or application/x-ndjson.
+        Every account needs a username, password and a role of merchant or customer,
+        balance is optional and defaults to 0.
+        Invalid rows, including lines that aren't a JSON object, and taken usernames are skipped and listed in errors.
+        Return 201 with an import summary.
+        Return 400 if the body isn't UTF-8, accounts before the undecodable line are still created.
+        Return 403 if request is done by a non-staff account.
+        Return 415 if the content type isn't supported.
+        """
+        content_type = request.content_type.split(";")[0].strip().lower()
+        fmt = CONTENT_TYPES.get(content_type)
+        if fmt is None:
+            return Response(
+                {"detail": "Content-Type Must Be text/csv Or application/x-ndjson"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        lines = provisioning.decode_lines(request._request)
+        try:
+            summary = provisioning.import_accounts(
+                provisioning.read_accounts(lines, fmt), executor=provisioning.shared_executor())
+        except UnicodeDecodeError as e:
+            return Response({"detail": f"Request Body Must Be UTF-8: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary, status=status.HTTP_201_CREATED)
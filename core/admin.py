@@ -1,7 +1,13 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from core.filters import search_username
 from core.models import User, Merchant, Customer
+from core import services, stats
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     fieldsets = (
@@ -20,12 +26,95 @@ class UserAdmin(BaseUserAdmin):
     search_fields = ('username',)
     list_display = ('username', 'is_merchant', 'is_customer', 'is_superuser')
 
+    # Through core.services.delete_users, like the merchant and customer admins.
+    def delete_model(self, request, obj):
+        services.delete_users([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        services.delete_users(queryset.values_list("id", flat=True))
+
 admin.site.unregister(Group)
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the row count of an unfiltered changelist from the
+    PostgreSQL planner statistics once the table is estimated above
+    ADMIN_COUNT_ESTIMATE_THRESHOLD rows, instead of a COUNT(*) over all of
+    it. The last pages may then come out short. Filtered lists, smaller
+    tables and other backends are counted exactly.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= getattr(settings, "ADMIN_COUNT_ESTIMATE_THRESHOLD", 100000):
+                return int(row[0])
+        return super().count
+
+BALANCE_RANGES = (
+    ("0", "0", 0, 0),
+    ("1-999", "1 to 999", 1, 999),
+    ("1000-99999", "1,000 to 99,999", 1000, 99999),
+    ("100000-", "100,000 and more", 100000, None),
+)
+
+class BalanceRangeFilter(admin.SimpleListFilter):
+    title = "balance"
+    parameter_name = "balance_range"
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, label, _, _ in BALANCE_RANGES]
+
+    def queryset(self, request, queryset):
+        for key, _, low, high in BALANCE_RANGES:
+            if self.value() == key:
+                queryset = queryset.filter(balance__gte=low)
+                return queryset if high is None else queryset.filter(balance__lte=high)
+        return queryset
+
+class ProfileAdmin(admin.ModelAdmin):
+    # Every changelist page costs the same few queries however large the
+    # table: usernames come from the join, the user is picked by id instead
+    # of a select of every user, and no COUNT(*) of the unfiltered table.
+    list_display = ("id", "user", "balance")
+    list_select_related = ("user",)
+    list_filter = (BalanceRangeFilter,)
+    raw_id_fields = ("user",)
+    search_fields = ("user__username",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Username prefix search, served by the username index.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return search_username(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        # Keep the /api/stats/ counters in step with balance edits and new profiles.
+        if change:
+            if "balance" in form.changed_data:
+                services.replace_balance(obj, obj.balance)
+        else:
+            role = "merchant" if isinstance(obj, Merchant) else "customer"
+            stats.record(**{f"{role}_count": 1, f"{role}_balance": obj.balance})
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        services.delete_users([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        services.delete_profiles(queryset)
+
 @admin.register(Merchant)
-class MerchantAdmin(admin.ModelAdmin):
-    pass
+class MerchantAdmin(ProfileAdmin):
+    list_display = ProfileAdmin.list_display + ("balance_shards",)
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(ProfileAdmin):
     pass
@@ -0,0 +1,141 @@
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils.http import parse_etags
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from core import cache
+from core.db import database_sync_to_async, use_primary
+from core.filters import filter_profiles, sparse_fieldset
+from core.models import Customer, Merchant
+from core.pagination import IdCursorPagination
+from core.serializers import CustomerSerializer, MerchantSerializer
+
+class AsyncView:
+    """
+    Minimal class based view whose handlers are coroutines, for the read
+    endpoints under ASGI. Django 3.2 has neither async class based views nor
+    an async ORM, so each view does all its database work in one
+    database_sync_to_async hop and everything else stays on the event loop.
+    Those hops run on any executor thread, so concurrent requests don't
+    queue on the single thread sync_to_async uses by default.
+    Requests are authenticated with the same classes as the DRF views.
+    """
+    http_method_names = ["get"]
+    require_authentication = False
+
+    @classmethod
+    def as_view(cls):
+        async def view(request, *args, **kwargs):
+            self = cls()
+            if request.method.lower() not in self.http_method_names:
+                return HttpResponseNotAllowed(self.http_method_names)
+
+            self.request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+            try:
+                user = await database_sync_to_async(lambda: self.request.user)()
+            except exceptions.APIException as e:
+                response = JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+                if isinstance(e, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    # Like APIView.handle_exception, a 401 needs the first
+                    # authenticator's challenge and is a 403 without one.
+                    header = self.request.authenticators[0].authenticate_header(self.request)
+                    if header:
+                        response["WWW-Authenticate"] = header
+                    else:
+                        response.status_code = status.HTTP_403_FORBIDDEN
+                return response
+            if self.require_authentication and not user.is_authenticated:
+                return JsonResponse(
+                    {"detail": "Authentication credentials were not provided."},
+                    status=status.HTTP_403_FORBIDDEN)
+
+            return await getattr(self, request.method.lower())(request, *args, **kwargs)
+
+        view.csrf_exempt = True
+        return view
+
+class AsyncListView(AsyncView):
+    model = None
+    serializer_class = None
+
+    def get_queryset(self):
+        return self.model.objects.select_related("user")
+
+    def list(self):
+        queryset, ordering = filter_profiles(self.get_queryset(), self.request.query_params)
+        queryset, serializer_class = sparse_fieldset(queryset, self.serializer_class, self.request.query_params)
+        paginator = IdCursorPagination()
+        paginator.ordering = ordering
+        if paginator.is_requested(self.request):
+            page = paginator.paginate_queryset(queryset, self.request)
+            if not page:
+                return None
+            return paginator.get_paginated_response(serializer_class(page, many=True).data).data
+        return serializer_class(queryset, many=True).data or None
+
+    async def get(self, request):
+        try:
+            data = await database_sync_to_async(self.list)()
+        except exceptions.APIException as e:
+            detail = e.detail if isinstance(e.detail, (dict, list)) else {"detail": str(e.detail)}
+            return JsonResponse(detail, status=e.status_code, safe=False)
+        if data is None:
+            return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+        return JsonResponse(data, safe=False)
+
+class AsyncDetailView(AsyncView):
+    model = None
+    serializer_class = None
+    require_authentication = True
+
+    def get_queryset(self):
+        return self.model.objects.select_related("user")
+
+    def retrieve(self, pk):
+        entry = cache.get_detail(self.model, pk)
+        if entry is None:
+            with use_primary():
+                instance = self.get_queryset().filter(pk=pk).first()
+            if instance is None:
+                return None
+            entry = cache.set_detail(self.model, pk, self.serializer_class(instance).data, instance.user_id)
+        return entry
+
+    async def get(self, request, pk):
+        entry = await database_sync_to_async(self.retrieve)(pk)
+        if entry is None:
+            return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        data, etag = entry
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = JsonResponse(data)
+        response["ETag"] = etag
+        return response
+
+class AsyncMerchantList(AsyncListView):
+    """
+    Like MerchantList, balance filters and ordering leave out pending shard credits.
+    """
+    model = Merchant
+    serializer_class = MerchantSerializer
+
+    def get_queryset(self):
+        return super().get_queryset().with_shard_balance()
+
+class AsyncCustomerList(AsyncListView):
+    model = Customer
+    serializer_class = CustomerSerializer
+
+class AsyncMerchantDetail(AsyncDetailView):
+    model = Merchant
+    serializer_class = MerchantSerializer
+
+    def get_queryset(self):
+        return super().get_queryset().with_shard_balance()
+
+class AsyncCustomerDetail(AsyncDetailView):
+    model = Customer
+    serializer_class = CustomerSerializer
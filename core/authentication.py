@@ -0,0 +1,162 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import authentication, exceptions
+
+from core.backends import attach_profiles
+from core.models import ApiKey, User
+
+KEYWORD = "Token"
+
+ISSUE_ATTEMPTS = 5
+
+Principal = namedtuple(
+    "Principal",
+    ["user_id", "username", "is_merchant", "is_customer", "is_superuser", "merchant_id", "customer_id"],
+)
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def issue_key(user, name=""):
+    """
+    Create an API key for a user. Returns the stored ApiKey and the raw key,
+    which is only available here. Prefixes are unique, one that's already
+    taken is drawn again.
+    """
+    for attempt in range(ISSUE_ATTEMPTS):
+        prefix = secrets.token_hex(4)
+        key = f"{prefix}.{secrets.token_urlsafe(32)}"
+        try:
+            with transaction.atomic():
+                api_key = ApiKey.objects.create(user=user, name=name, prefix=prefix, key_hash=hash_key(key))
+        except IntegrityError:
+            if attempt == ISSUE_ATTEMPTS - 1:
+                raise
+            continue
+        return api_key, key
+
+def revoke_keys(prefix):
+    """
+    Delete the key with a prefix, returns how many were deleted. Other
+    processes keep accepting a revoked key until their cached principal
+    expires, see API_KEY_CACHE_TTL.
+    """
+    hashes = list(ApiKey.objects.filter(prefix=prefix).values_list("key_hash", flat=True))
+    ApiKey.objects.filter(prefix=prefix).delete()
+    for key_hash in hashes:
+        principals.discard(key_hash)
+    return len(hashes)
+
+class PrincipalCache:
+    """
+    Thread safe key hash -> Principal map whose entries expire after ``ttl`` seconds.
+    """
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key_hash):
+        entry = self._entries.get(key_hash)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key_hash, principal):
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self.maxsize:
+                    self._entries.clear()
+            self._entries[key_hash] = (time.monotonic() + self.ttl, principal)
+
+    def discard(self, key_hash):
+        with self._lock:
+            self._entries.pop(key_hash, None)
+
+    def discard_users(self, user_ids):
+        """
+        Drop the principals of some users, whose roles or profiles changed.
+        """
+        user_ids = set(user_ids)
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[1].user_id not in user_ids}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+principals = PrincipalCache(
+    getattr(settings, "API_KEY_CACHE_TTL", 60),
+    getattr(settings, "API_KEY_CACHE_SIZE", 10000),
+)
+
+def load_principal(key_hash):
+    row = (
+        ApiKey.objects
+        .filter(key_hash=key_hash, user__is_active=True)
+        .values_list(
+            "user_id", "user__username", "user__is_merchant", "user__is_customer",
+            "user__is_superuser", "user__merchant__id", "user__customer__id",
+        )
+        .first()
+    )
+    return Principal(*row) if row else None
+
+def principal_user(principal):
+    """
+    Build the request user from a principal without touching the database.
+    ``user.merchant`` / ``user.customer`` are attached with just their ids
+    set, enough for the role and ownership checks done by the views.
+    """
+    user = User(
+        id=principal.user_id,
+        username=principal.username,
+        is_merchant=principal.is_merchant,
+        is_customer=principal.is_customer,
+        is_superuser=principal.is_superuser,
+        is_active=True,
+    )
+    user._state.adding = False
+    user._state.db = "default"
+    return attach_profiles(user, principal.merchant_id, principal.customer_id)
+
+class ApiKeyAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticate with ``Authorization: Token <key>``.
+
+    Keys are looked up by their SHA-256 hash through a unique index, and the
+    resulting principal is cached in process for API_KEY_CACHE_TTL seconds,
+    so repeated requests don't pay for a password hash or any query.
+    """
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        key_hash = hash_key(key)
+        principal = principals.get(key_hash)
+        if principal is None:
+            principal = load_principal(key_hash)
+            if principal is None:
+                raise exceptions.AuthenticationFailed("Invalid token.")
+            principals.set(key_hash, principal)
+        return principal_user(principal), key_hash
+
+    def authenticate_header(self, request):
+        return KEYWORD
@@ -0,0 +1,130 @@
+from contextvars import ContextVar
+
+from django.contrib.auth import SESSION_KEY, user_logged_in
+from django.contrib.auth.backends import ModelBackend
+from django.dispatch import receiver
+from django.utils.functional import empty
+
+from core.db import database_sync_to_async
+from core.middleware import HybridMiddleware
+from core.models import Customer, Merchant, User
+
+PROFILE_SESSION_KEY = "_auth_profile"
+
+_session_profile = ContextVar("session_profile", default=None)
+
+def profile_ids(user):
+    """
+    Return the (merchant id, customer id) of a user, None for a role it
+    doesn't have.
+    """
+    merchant = getattr(user, "merchant", None) if user.is_merchant else None
+    customer = getattr(user, "customer", None) if user.is_customer else None
+    return (merchant.id if merchant else None, customer.id if customer else None)
+
+def attach_profiles(user, merchant_id, customer_id):
+    """
+    Set ``user.merchant`` / ``user.customer`` to unsaved instances with just
+    their ids, enough for the role and ownership checks done by the views.
+    """
+    if merchant_id is not None:
+        user.merchant = Merchant(id=merchant_id, user_id=user.id)
+    if customer_id is not None:
+        user.customer = Customer(id=customer_id, user_id=user.id)
+    return user
+
+@receiver(user_logged_in)
+def remember_profile(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, "session"):
+        request.session[PROFILE_SESSION_KEY] = list(profile_ids(user))
+
+class ProfileSessionMiddleware(HybridMiddleware):
+    """
+    Hand the profile ids stored in the session at login to
+    ProfileModelBackend.get_user, so loading the session's user needs no
+    join on the profile tables. Goes after AuthenticationMiddleware.
+
+    Sessions from before this was deployed, or whose user changed roles
+    since, get their stored ids written once the user has been loaded.
+    """
+    def handle(self, request):
+        stored = request.session.get(PROFILE_SESSION_KEY)
+        token = _session_profile.set(tuple(stored) if stored else None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _session_profile.reset(token)
+        self.refresh(request, stored)
+        return response
+
+    async def ahandle(self, request):
+        # Loading a session queries the database, requests without one skip
+        # the thread hops.
+        if request.session.session_key is None:
+            return await self.get_response(request)
+        stored = await database_sync_to_async(request.session.get)(PROFILE_SESSION_KEY)
+        token = _session_profile.set(tuple(stored) if stored else None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _session_profile.reset(token)
+        await database_sync_to_async(self.refresh)(request, stored)
+        return response
+
+    def refresh(self, request, stored):
+        user = getattr(request, "user", None)
+        if user is None or getattr(user, "_wrapped", None) is empty or SESSION_KEY not in request.session:
+            # The session's user was never loaded, nothing to refresh.
+            return
+        if user.is_authenticated and str(user.pk) == request.session[SESSION_KEY]:
+            current = list(profile_ids(user))
+            if current != stored:
+                request.session[PROFILE_SESSION_KEY] = current
+
+class ProfileModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's merchant and customer profile in the
+    same query, for both session and Basic authentication. Views read
+    ``request.user.merchant`` / ``request.user.customer`` for role and
+    ownership checks, and this makes those reads free.
+
+    Session users whose profile ids were stored at login are loaded
+    without the join, see ProfileSessionMiddleware.
+    """
+    def get_queryset(self):
+        return User._default_manager.select_related("merchant", "customer")
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = self.get_queryset().get(**{User.USERNAME_FIELD: username})
+        except User.DoesNotExist:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user.
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        profile = _session_profile.get()
+        try:
+            if profile is None:
+                user = self.get_queryset().get(pk=user_id)
+            else:
+                user = User._default_manager.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+
+        if profile is not None:
+            merchant_id, customer_id = profile
+            if user.is_merchant == (merchant_id is not None) and user.is_customer == (customer_id is not None):
+                attach_profiles(user, merchant_id, customer_id)
+            else:
+                # The roles changed since login, load the profiles for real.
+                user = self.get_queryset().get(pk=user_id)
+        return user if self.user_can_authenticate(user) else None
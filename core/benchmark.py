@@ -0,0 +1,146 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from core import stats
+from core.metrics import QueryRecorder
+from core.models import Customer, Merchant, User
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def summarize(latencies, seconds):
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+@contextmanager
+def test_database():
+    """
+    Run the block against a throwaway test database, replicas mirror it.
+    """
+    setup_test_environment()
+    for alias in connections:
+        if alias != "default":
+            connections[alias].settings_dict["TEST"]["MIRROR"] = "default"
+    default = connections["default"]
+    if default.vendor == "sqlite" and not default.settings_dict["TEST"].get("NAME"):
+        # Threads can't write concurrently to an in-memory database, use a file in WAL mode.
+        default.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.gettempdir(), "bill_id_benchmark.sqlite3")
+
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+def seed(merchants, customers, balance=10 ** 9, batch_size=5000, password="benchmark"):
+    """
+    Insert ``merchants`` and ``customers`` accounts with bulk_create, sharing
+    one password hash, and rebuild the stats counters afterwards. That also
+    creates every counter shard's row, so a request's queries don't depend
+    on which shard stats.record() picks.
+    """
+    password_hash = make_password(password)
+    for role, model, count in (("merchant", Merchant, merchants), ("customer", Customer, customers)):
+        for start in range(0, count, batch_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(
+                        username=f"bench-{role}-{number}", password=password_hash,
+                        is_merchant=role == "merchant", is_customer=role == "customer",
+                    )
+                    for number in range(start, min(start + batch_size, count))
+                ])
+                if any(user.pk is None for user in users):
+                    users = User.objects.filter(username__in=[user.username for user in users])
+                model.objects.bulk_create([model(user_id=user.pk, balance=balance) for user in users])
+    stats.rebuild()
+
+def run(request, requests, concurrency, seed=0):
+    """
+    Call ``request(client, rng)``, which makes one request with the test
+    client and returns the response, ``requests`` times over ``concurrency``
+    threads, each with its own client and database connection. Every call
+    gets a random generator seeded from ``seed`` and its number, so runs are
+    reproducible. Returns the throughput, the latency percentiles, the mean
+    queries per request and the number of error responses.
+    """
+    local = threading.local()
+    errors, queries = [], []
+    lock = threading.Lock()
+
+    def fetch(number):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        rng = random.Random(seed * 1000003 + number)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = request(local.client, rng)
+        latency = time.perf_counter() - started
+        with lock:
+            queries.append(recorder.count)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        return latency
+
+    def close(_):
+        connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(fetch, range(requests)))
+        list(executor.map(close, range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - started)
+    result.update(
+        queries_per_request=round(sum(queries) / len(queries), 2),
+        errors=len(errors),
+    )
+    return result
+
+# Queries per request barely vary between runs, only by where cache hits
+# land. A fraction of the baseline, like the tolerance.
+QUERY_SLACK = 0.05
+
+def compare(results, baseline, tolerance):
+    """
+    Return a description of every result that regressed against the
+    baseline: throughput or p99 latency worse by more than ``tolerance``
+    (a fraction), more queries per request by more than QUERY_SLACK, or
+    more errors.
+    """
+    previous = {(result["scenario"], result["concurrency"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = previous.get((result["scenario"], result["concurrency"]))
+        if base is None:
+            continue
+        label = f"{result['scenario']} c={result['concurrency']}"
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{label}: {result['rps']} req/s, baseline {base['rps']}")
+        if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p99 {result['p99_ms']} ms, baseline {base['p99_ms']}")
+        if result["queries_per_request"] > base["queries_per_request"] * (1 + QUERY_SLACK):
+            regressions.append(
+                f"{label}: {result['queries_per_request']} queries per request, "
+                f"baseline {base['queries_per_request']}")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{label}: {result['errors']} errors, baseline {base['errors']}")
+    return regressions
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.db import use_primary
+
+def _cache():
+    return caches[getattr(settings, "DETAIL_CACHE_ALIAS", "default")]
+
+def detail_key(model, pk):
+    return f"detail:{model._meta.label_lower}:{pk}"
+
+def owner_key(model, user_id):
+    return f"detail-owner:{model._meta.label_lower}:{user_id}"
+
+def get_detail(model, pk):
+    """
+    Return the cached (data, etag) of an object's detail response, or None.
+    """
+    return _cache().get(detail_key(model, pk))
+
+def set_detail(model, pk, data, user_id=None):
+    """
+    Cache an object's detail response and return it as (data, etag). Passing
+    the owning user's id lets invalidate_owner_details find it on User saves.
+    """
+    data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+    etag = '"%s"' % hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    timeout = getattr(settings, "DETAIL_CACHE_TIMEOUT", 300)
+    entries = {detail_key(model, pk): (data, etag)}
+    if user_id is not None:
+        entries[owner_key(model, user_id)] = pk
+    _cache().set_many(entries, timeout)
+    return data, etag
+
+def invalidate_detail(model, *pks):
+    """
+    Drop cached detail responses once the current transaction commits, so a
+    concurrent read can't cache the old state again before the write lands.
+    """
+    keys = [detail_key(model, pk) for pk in pks]
+    if keys:
+        transaction.on_commit(lambda: _cache().delete_many(keys))
+
+def invalidate_owner_details(user_id, *models):
+    """
+    Drop the cached detail responses of the profiles owned by a user, found
+    through the owner index instead of querying the profile tables.
+    """
+    def delete():
+        cache = _cache()
+        owned = cache.get_many([owner_key(model, user_id) for model in models])
+        keys = list(owned)
+        for model in models:
+            pk = owned.get(owner_key(model, user_id))
+            if pk is not None:
+                keys.append(detail_key(model, pk))
+        cache.delete_many(keys)
+    transaction.on_commit(delete)
+
+class CachedRetrieveModelMixin:
+    """
+    Retrieve a model instance through the detail cache, with ETag support.
+
+    A hit skips both the query and the serializer. A request whose
+    If-None-Match matches the current ETag gets a 304 with no body.
+    """
+    def retrieve(self, request, *args, **kwargs):
+        model = self.get_queryset().model
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+
+        entry = get_detail(model, pk)
+        if entry is None:
+            # Filled from the primary, a lagging replica could put back the
+            # state an invalidate_detail() just dropped for the cache's timeout.
+            with use_primary():
+                instance = self.get_object()
+            entry = set_detail(model, pk, self.get_serializer(instance).data, getattr(instance, "user_id", None))
+        data, etag = entry
+
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(data, headers={"ETag": etag})
@@ -5,20 +5,29 @@ from rest_framework import generics
 from rest_framework import views
 from rest_framework import permissions
 
-from core.serializers import CreateUserSerializer, CustomerSerializer
-from core.models import Customer, Merchant
-from core.permissions import IsStaffOrReadOnly
+from core.serializers import INTEGER_MAX, USERNAME_TAKEN, BulkTransactionItemSerializer, CreateUserSerializer, CustomerSerializer, TransactionSerializer, validate_purchase
+from core.models import Customer, Merchant, Transaction
+from core import idempotency, services
+from core.cache import CachedRetrieveModelMixin
+from core.permissions import IsOwnerOrSuperuser, IsProfileOwnerOrSuperuser, IsStaffOrReadOnly
+from core.pagination import IdCursorPagination, TransactionCursorPagination, LIST_PARAMETERS, is_ndjson_export, stream_ndjson
+from core.filters import FILTER_PARAMETERS, filter_profiles, sparse_fieldset
 
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.conf import settings
 
 class CustomerList(views.APIView):
     permission_classes = [IsStaffOrReadOnly,]
 
     @swagger_auto_schema(
+        manual_parameters=LIST_PARAMETERS + FILTER_PARAMETERS,
         responses={
             200: CustomerSerializer(),
-            204: "No Content"
+            204: "No Content",
+            400: "Bad Request",
         }
     )
     def get(self, request):
@@ -26,9 +35,29 @@ class CustomerList(views.APIView):
         Customer's List
 
         List all customers, if 0 customer exists return 204.
+        Pass search, min_balance and max_balance to filter by username prefix and balance,
+        and ordering (id, -id, balance, -balance) to sort, return 400 if they're invalid.
+        Pass compact=1, or fields with a subset of id, username and balance, to get flat objects.
+        Pass page_size and/or cursor to get a cursor paginated response.
+        Pass export=ndjson to stream every customer as newline delimited JSON.
         """
-        customer = Customer.objects.all()
-        serializer = CustomerSerializer(customer, many=True)
+        customer, ordering = filter_profiles(Customer.objects.select_related("user"), request.query_params)
+        customer, serializer_class = sparse_fieldset(customer, CustomerSerializer, request.query_params)
+        if is_ndjson_export(request):
+            if not customer.exists():
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            return stream_ndjson(customer, serializer_class)
+
+        paginator = IdCursorPagination()
+        paginator.ordering = ordering
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(customer, request, view=self)
+            if not page:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            serializer = serializer_class(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        serializer = serializer_class(customer, many=True)
         if not serializer.data:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(serializer.data)
@@ -52,25 +81,22 @@ class CustomerList(views.APIView):
         """
         serializer = CreateUserSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            user.is_customer = True
-            user.set_password(serializer.data["password"])
-            user.save()
-            
-            customer = Customer.objects.get(id=user.customer.id)
-            customer_serializer = CustomerSerializer(customer)
-            return Response(customer_serializer.data)
+            try:
+                user = services.create_account(is_customer=True, **serializer.validated_data)
+            except services.UsernameTaken:
+                return Response({"username": [USERNAME_TAKEN]}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(CustomerSerializer(user.customer).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class CustomerDetail(
-                    mixins.RetrieveModelMixin,
+                    CachedRetrieveModelMixin,
                     mixins.UpdateModelMixin,
                     mixins.DestroyModelMixin,
                     generics.GenericAPIView):
 
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.select_related("user")
     serializer_class = CustomerSerializer
-    permission_classes = [permissions.IsAuthenticated,]
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrSuperuser,]
 
     @swagger_auto_schema(
         responses={
@@ -105,12 +131,7 @@ class CustomerDetail(
         Return 400 if request is invalid.
         Return 404 if no customer found with that ID.
         """
-
-        if request.user.is_customer and request.user.customer.id == kwargs["pk"] or request.user.is_superuser:
-            return self.update(request, *args, **kwargs)
-        return Response(
-                {"detail": "Only Superuser or The Requested Account Can Perform This Action"},
-                status=status.HTTP_403_FORBIDDEN)
+        return self.update(request, *args, **kwargs)
 
     @swagger_auto_schema(
         responses={
@@ -127,17 +148,48 @@ class CustomerDetail(
         Return 204 with no content if customer exists and deleted successfully.
         Return 404 if no customer found with that ID.
         """
+        return self.destroy(request, *args, **kwargs)
 
-        if request.user.is_customer and request.user.customer.id == kwargs["pk"] or request.user.is_superuser:
-            return self.destroy(request, *args, **kwargs)
-        return Response(
-                {"detail": "Only Superuser or The Requested Account Can Perform This Action"},
-                status=status.HTTP_403_FORBIDDEN)
+class CustomerTransactionList(mixins.ListModelMixin, generics.GenericAPIView):
+    serializer_class = TransactionSerializer
+    pagination_class = TransactionCursorPagination
+    permission_classes = [permissions.IsAuthenticated, IsProfileOwnerOrSuperuser,]
+    owner_role = "customer"
+
+    def get_queryset(self):
+        if getattr(self, "swagger_fake_view", False):
+            return Transaction.objects.none()
+        return Transaction.objects.filter(customer_id=self.kwargs["pk"])
+
+    @swagger_auto_schema(
+        responses={
+            200: TransactionSerializer(many=True),
+            403: "Either You Aren't Authenticated Or You Didn't Have Permission To Request",
+            404: "Invalid Customer's ID or Not Found"
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        """
+        Customer's Transaction History
+
+        Can only be done by an admin account or by requested account, return 403 otherwise.
+        Return 200 with a cursor paginated list of transactions, newest first.
+        Return 404 if no customer found with that ID.
+        """
+        if not Customer.objects.filter(pk=kwargs["pk"]).exists():
+            raise Http404
+        return self.list(request, *args, **kwargs)
+
+IDEMPOTENCY_KEY_PARAMETER = openapi.Parameter(
+    idempotency.HEADER, openapi.IN_HEADER,
+    "Unique key per purchase, retries with the same key replay the first response instead of charging again.",
+    type=openapi.TYPE_STRING)
 
 class CustomerBuy(views.APIView):
     permission_classes = [permissions.IsAuthenticated,]
 
     @swagger_auto_schema(
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
         responses={
             200: CustomerSerializer(),
             400: "Bad Request",
@@ -151,6 +203,9 @@ class CustomerBuy(views.APIView):
         Transaction
 
         Can only be done by a customer user, return 403 otherwise.
+        If an Idempotency-Key header is sent, a successful transaction is only made once
+        and retries with the same key return the original response.
+        Return 400 if the merchant ID or price is above 2147483647, or the Idempotency-Key is too long.
         Return 402 if customer doesn't have enough balance.
         Return 404 if no merchant with that ID exists.
         """
@@ -158,21 +213,128 @@ class CustomerBuy(views.APIView):
             return Response(
                 {"detail": "Only Authorized Customer Can Make A Transaction Using Their ID"},
                 status=status.HTTP_403_FORBIDDEN)
+        if merc_id > INTEGER_MAX or price > INTEGER_MAX:
+            return Response(
+                {"detail": f"Merchant ID And Price Must Be At Most {INTEGER_MAX}"},
+                status=status.HTTP_400_BAD_REQUEST)
+        return self.purchase(request, merc_id, price)
 
-        customer = get_object_or_404(Customer, id=request.user.customer.id)
-        merchant = get_object_or_404(Merchant, id=merc_id)
+    def purchase(self, request, merc_id, price):
+        key = request.headers.get(idempotency.HEADER)
+        if key is not None:
+            if len(key) > idempotency.MAX_KEY_LENGTH:
+                return Response(
+                    {"detail": f"Idempotency-Key Must Be At Most {idempotency.MAX_KEY_LENGTH} Characters"},
+                    status=status.HTTP_400_BAD_REQUEST)
+            stored = idempotency.lookup(request.user.id, key)
+            if stored is not None:
+                return Response(stored[1], status=stored[0])
 
-        if customer.balance < price:
+        try:
+            with transaction.atomic():
+                balance = services.transfer(request.user.customer.id, merc_id, price)
+                detail = {"detail": f"Transaction Successfull, Your Remaining Balance {balance}"}
+                if key is not None:
+                    idempotency.remember(request.user.id, key, status.HTTP_200_OK, detail)
+        except Merchant.DoesNotExist:
+            raise Http404
+        except services.InsufficientBalance:
             return Response(
                 {"detail": "Customer Did Not Have Enough Balance To Complete The Transaction"},
                 status=status.HTTP_402_PAYMENT_REQUIRED)
+        except IntegrityError:
+            # A concurrent retry with the same key committed first, replay its response.
+            stored = idempotency.lookup(request.user.id, key) if key is not None else None
+            if stored is None:
+                raise
+            return Response(stored[1], status=stored[0])
+
+        return Response(detail, status=status.HTTP_200_OK)
 
-        customer.balance -= price
-        customer.save()
+class CustomerPurchase(CustomerBuy):
 
-        merchant.balance += price
-        merchant.save()
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=["merchant_id", "amount"],
+            properties={
+                "merchant_id": openapi.Schema(type=openapi.TYPE_INTEGER, minimum=1, maximum=INTEGER_MAX),
+                "amount": openapi.Schema(type=openapi.TYPE_INTEGER, minimum=1, maximum=INTEGER_MAX),
+            },
+        ),
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
+        responses={
+            200: "Transaction Successfull With The Remaining Balance",
+            400: "Bad Request",
+            402: "Customer Didn't Have Enough Balance To Complete The Transaction",
+            403: "Only Authorized Customer Can Make A Transaction Using Their ID",
+            404: "The Merchant ID Is Invalid, Thus Merchant Are Not Found"
+        }
+    )
+    def post(self, request):
+        """
+        Transaction
+
+        Same as /transaction/{merc_id}/{price}/ with a {"merchant_id": ..., "amount": ...} body,
+        so every purchase shares one URL.
+        Can only be done by a customer user, return 403 otherwise.
+        Return 400 if merchant_id or amount isn't a positive integer up to 2147483647, or the Idempotency-Key is too long.
+        Return 402 if customer doesn't have enough balance.
+        Return 404 if no merchant with that ID exists.
+        """
+        if not request.user.is_customer:
+            return Response(
+                {"detail": "Only Authorized Customer Can Make A Transaction Using Their ID"},
+                status=status.HTTP_403_FORBIDDEN)
+
+        (merchant_id, amount), errors = validate_purchase(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return self.purchase(request, merchant_id, amount)
+
+class CustomerBulkBuy(views.APIView):
+    permission_classes = [permissions.IsAuthenticated,]
+
+    @swagger_auto_schema(
+        request_body=BulkTransactionItemSerializer(many=True),
+        responses={
+            200: "Remaining Balance And A Result For Every Item",
+            400: "Bad Request",
+            403: "Only Authorized Customer Can Make A Transaction Using Their ID",
+            409: "Balance Kept Changing While The Batch Was Applied, Retry The Request"
+        }
+    )
+    def post(self, request):
+        """
+        Bulk Transaction
+
+        Can only be done by a customer user, return 403 otherwise.
+        Items are applied in order, every item gets its own status:
+        200 if it succeeded, 402 if the balance left wasn't enough, 404 if the merchant doesn't exist.
+        Return 400 if the request is invalid or has more than BULK_TRANSACTION_MAX_ITEMS items.
+        """
+        if not request.user.is_customer:
+            return Response(
+                {"detail": "Only Authorized Customer Can Make A Transaction Using Their ID"},
+                status=status.HTTP_403_FORBIDDEN)
+
+        # Checked before validation, so an oversized batch costs no work.
+        max_items = getattr(settings, "BULK_TRANSACTION_MAX_ITEMS", 1000)
+        if isinstance(request.data, list) and len(request.data) > max_items:
+            return Response(
+                {"detail": f"A Bulk Transaction Can Have At Most {max_items} Items"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = BulkTransactionItemSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        items = [(item["merchant_id"], item["price"]) for item in serializer.validated_data]
+        try:
+            balance, results = services.bulk_transfer(request.user.customer.id, items)
+        except services.BalanceChanged:
+            return Response(
+                {"detail": "Balance Kept Changing While The Batch Was Applied, Retry The Request"},
+                status=status.HTTP_409_CONFLICT)
 
-        return Response(
-                {"detail": f"Transaction Successfull, Your Remaining Balance {customer.balance}"},
-                status=status.HTTP_200_OK)
+        return Response({"balance": balance, "results": results}, status=status.HTTP_200_OK)
@@ -0,0 +1,132 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from core.middleware import HybridMiddleware
+
+READ_ONLY_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Read from the primary even in GET requests: a lagging replica would log a
+# user out right after logging in, or reject a freshly issued API key.
+PRIMARY_MODELS = ("sessions.session", "core.apikey")
+
+_use_replica = ContextVar("use_replica", default=False)
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != "default"]
+
+@contextmanager
+def use_primary():
+    """
+    Send the reads inside the block to the primary, for data that outlives
+    the request, like cache fills, and mustn't be stale.
+    """
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+def database_sync_to_async(func):
+    """
+    Like sync_to_async, but run ``func`` on any thread of the executor
+    instead of the one thread Django 3.2 shares between every async request
+    (thread_sensitive=True), so the database work of concurrent requests
+    isn't serialized. Connections of those threads are outside Django's
+    request cycle, so stale ones are closed around each call.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    """
+    Let the reads of GET/HEAD/OPTIONS requests go to a read replica. Anything
+    else, and every read inside those requests' transactions, stays on the
+    primary so it sees its own writes. So do sessions, users and API keys,
+    see PRIMARY_MODELS.
+
+    Works in both sync and async middleware chains, the flag is a context
+    variable and follows the request into sync_to_async threads.
+    """
+    def handle(self, request):
+        token = _use_replica.set(request.method in READ_ONLY_METHODS)
+        try:
+            return self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+    async def ahandle(self, request):
+        token = _use_replica.set(request.method in READ_ONLY_METHODS)
+        try:
+            return await self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not _use_replica.get() or transaction.get_connection().in_atomic_block:
+            return "default"
+        label = model._meta.label_lower
+        if label in PRIMARY_MODELS or label == settings.AUTH_USER_MODEL.lower():
+            return "default"
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+def _check_on_first_use(conn):
+    ensure_connection = conn.ensure_connection
+
+    def ensure_checked_connection():
+        if conn.health_check_pending:
+            conn.health_check_pending = False
+            if conn.connection is not None and not conn.in_atomic_block and not conn.is_usable():
+                conn.close()
+        ensure_connection()
+
+    conn.ensure_connection = ensure_checked_connection
+
+@receiver(request_started)
+def check_persistent_connections(sender, **kwargs):
+    """
+    Drop persistent connections that went away while idle, so the request
+    reconnects instead of failing. Django 4.1+ does this with CONN_HEALTH_CHECKS.
+
+    Like there, a connection is only pinged when the request first uses it,
+    requests that never touch a database, or a replica, don't pay for it.
+    """
+    if django.VERSION >= (4, 1):
+        return
+    for conn in connections.all():
+        if conn.settings_dict.get("CONN_HEALTH_CHECKS") and conn.settings_dict.get("CONN_MAX_AGE"):
+            if not hasattr(conn, "health_check_pending"):
+                _check_on_first_use(conn)
+            conn.health_check_pending = True
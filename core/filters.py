@@ -0,0 +1,116 @@
+import sys
+from functools import partial
+
+from drf_yasg import openapi
+from rest_framework import serializers
+
+from core.serializers import COMPACT_FIELDS, INTEGER_MAX, INTEGER_MIN, CompactSerializer
+
+ORDERINGS = ("id", "-id", "balance", "-balance")
+
+FILTER_PARAMETERS = [
+    openapi.Parameter("search", openapi.IN_QUERY, "Only return accounts whose username starts with this prefix.", type=openapi.TYPE_STRING),
+    openapi.Parameter("min_balance", openapi.IN_QUERY, "Only return accounts with at least this balance.", type=openapi.TYPE_INTEGER),
+    openapi.Parameter("max_balance", openapi.IN_QUERY, "Only return accounts with at most this balance.", type=openapi.TYPE_INTEGER),
+    openapi.Parameter("ordering", openapi.IN_QUERY, "Sort order, defaults to id.", type=openapi.TYPE_STRING, enum=list(ORDERINGS)),
+    openapi.Parameter("compact", openapi.IN_QUERY, "Set to 1 for flat id, username and balance objects.", type=openapi.TYPE_INTEGER, enum=[1]),
+    openapi.Parameter("fields", openapi.IN_QUERY, f"Comma separated subset of {', '.join(COMPACT_FIELDS)}, implies compact.", type=openapi.TYPE_STRING),
+]
+
+def _prefix_upper_bound(prefix):
+    """
+    Return the smallest string above every string starting with ``prefix``,
+    or None if there's none because it only has the last code point.
+    """
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        # Surrogates can't be encoded, skip to the code point after them.
+        following = 0xE000
+    return prefix[:-1] + chr(following)
+
+def search_username(queryset, prefix):
+    """
+    Filter a Merchant or Customer queryset to usernames starting with
+    ``prefix``. The range on top of startswith lets the username index be
+    range scanned on every backend, including SQLite where LIKE is case
+    insensitive and can't use it.
+    """
+    upper_bound = _prefix_upper_bound(prefix)
+    if upper_bound is not None:
+        queryset = queryset.filter(user__username__lt=upper_bound)
+    return queryset.filter(user__username__gte=prefix, user__username__startswith=prefix)
+
+def _int_param(params, name, errors):
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        errors[name] = ["A valid integer is required."]
+        return None
+    if not INTEGER_MIN <= value <= INTEGER_MAX:
+        errors[name] = [f"Ensure this value is between {INTEGER_MIN} and {INTEGER_MAX}."]
+        return None
+    return value
+
+def filter_profiles(queryset, params):
+    """
+    Apply the search, min_balance, max_balance and ordering query parameters
+    to a Merchant or Customer queryset. Returns the queryset and the ordering
+    to paginate by, raises ValidationError on invalid parameters.
+
+    Balances are compared and sorted on the indexed ``balance`` column, a
+    sharded merchant's pending shard credits aren't included.
+    """
+    errors = {}
+    min_balance = _int_param(params, "min_balance", errors)
+    max_balance = _int_param(params, "max_balance", errors)
+    search = params.get("search")
+    if search and "\x00" in search:
+        errors["search"] = ["Null characters are not allowed."]
+    ordering = params.get("ordering") or "id"
+    if ordering not in ORDERINGS:
+        errors["ordering"] = [f"Must be one of {', '.join(ORDERINGS)}."]
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    if search:
+        queryset = search_username(queryset, search)
+    if min_balance is not None:
+        queryset = queryset.filter(balance__gte=min_balance)
+    if max_balance is not None:
+        queryset = queryset.filter(balance__lte=max_balance)
+
+    # Ties on balance are broken by id so the order, and the cursors, are stable.
+    ordering = (ordering,) if ordering.endswith("id") else (ordering, ordering.replace("balance", "id"))
+    return queryset.order_by(*ordering), ordering
+
+def sparse_fieldset(queryset, serializer_class, params):
+    """
+    Switch a Merchant or Customer list to the compact representation when
+    ``compact=1`` or ``fields=`` is passed. Returns the queryset reading
+    flat ``.values()`` and a CompactSerializer for them, or both unchanged.
+    Raises ValidationError on unknown fields.
+    """
+    fields = params.get("fields")
+    if fields:
+        fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = [field for field in fields if field not in COMPACT_FIELDS]
+        if unknown or not fields:
+            raise serializers.ValidationError({"fields": [f"Must be a comma separated subset of {', '.join(COMPACT_FIELDS)}."]})
+    elif params.get("compact") in ("1", "true"):
+        fields = COMPACT_FIELDS
+    else:
+        return queryset, serializer_class
+
+    # Only the requested columns, so the user table is joined just for
+    # usernames, plus the ordering's for the pagination cursor.
+    columns = {"user__username" if field == "username" else field for field in fields}
+    columns.update(field.lstrip("-") for field in queryset.query.order_by)
+    if "balance" in fields and "shard_balance" in queryset.query.annotations:
+        columns.add("shard_balance")
+    return queryset.values(*sorted(columns)), partial(CompactSerializer, fields=fields)
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core.models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+
+class ResponseCache:
+    """
+    Small thread safe LRU of stored responses, checked before the database.
+
+    Entries carry their creation time so expired keys are never replayed,
+    even if the database row hasn't been purged yet.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            if entry[0] < timezone.now() - get_ttl():
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry[1], entry[2]
+
+    def set(self, cache_key, created, status_code, response):
+        with self._lock:
+            self._entries[cache_key] = (created, status_code, response)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+cache = ResponseCache(getattr(settings, "IDEMPOTENCY_CACHE_SIZE", 1024))
+
+def lookup(user_id, key):
+    """
+    Return the stored (status_code, response) for a key, or None if the key
+    is unknown or has expired.
+    """
+    stored = cache.get((user_id, key))
+    if stored is not None:
+        return stored
+
+    row = (
+        IdempotencyKey.objects
+        .filter(user_id=user_id, key=key, created__gte=timezone.now() - get_ttl())
+        .values_list("created", "status_code", "response")
+        .first()
+    )
+    if row is None:
+        return None
+    cache.set((user_id, key), *row)
+    return row[1], row[2]
+
+def remember(user_id, key, status_code, response):
+    """
+    Store a response for replay. Must run in the same transaction as the
+    side effects it describes, so both commit or neither does.
+
+    An expired row for the key that hasn't been purged yet is replaced.
+    """
+    try:
+        with transaction.atomic():
+            stored = IdempotencyKey.objects.create(user_id=user_id, key=key, status_code=status_code, response=response)
+    except IntegrityError:
+        expired = IdempotencyKey.objects.filter(user_id=user_id, key=key, created__lt=timezone.now() - get_ttl())
+        if not expired.delete()[0]:
+            raise
+        stored = IdempotencyKey.objects.create(user_id=user_id, key=key, status_code=status_code, response=response)
+    transaction.on_commit(lambda: cache.set((user_id, key), stored.created, status_code, response))
+
+def purge_expired():
+    """
+    Delete every expired key in a single statement. Returns the number of rows removed.
+    """
+    deleted, _ = IdempotencyKey.objects.filter(created__lt=timezone.now() - get_ttl()).delete()
+    return deleted
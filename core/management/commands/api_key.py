@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.authentication import KEYWORD, issue_key, revoke_keys
+from core.models import ApiKey, User
+
+class Command(BaseCommand):
+    help = "Issue, list and revoke API keys for token authentication"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        issue = subparsers.add_parser("issue", help="Create a key, it is printed once and can't be recovered")
+        issue.add_argument("username")
+        issue.add_argument("--name", default="")
+
+        listing = subparsers.add_parser("list", help="Show the keys of a user")
+        listing.add_argument("username")
+
+        revoke = subparsers.add_parser("revoke", help="Delete a key by its prefix")
+        revoke.add_argument("prefix")
+
+    def handle(self, *args, **options):
+        if options["action"] == "revoke":
+            if not revoke_keys(options["prefix"]):
+                raise CommandError(f"No key with prefix {options['prefix']}")
+            self.stdout.write(self.style.SUCCESS(f"Revoked key {options['prefix']}"))
+            return
+
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        if options["action"] == "issue":
+            api_key, key = issue_key(user, options["name"])
+            self.stdout.write(self.style.SUCCESS(f"Issued key {api_key.prefix} for {user.username}"))
+            self.stdout.write(f"Authorization: {KEYWORD} {key}")
+        else:
+            for api_key in ApiKey.objects.filter(user=user).order_by("created"):
+                self.stdout.write(f"{api_key.prefix}  {api_key.created:%Y-%m-%d %H:%M}  {api_key.name}")
@@ -0,0 +1,106 @@
+import itertools
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import benchmark, services
+from core.authentication import KEYWORD, issue_key
+from core.models import Customer, Merchant
+
+SCENARIOS = ("list", "detail", "create", "transaction", "purchase")
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and load the list, detail, create and transaction "
+        "(URL and JSON body) endpoints in process at several concurrency levels. Prints JSON results, and with "
+        "--baseline exits non-zero if they regressed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--merchants", type=int, default=10000)
+        parser.add_argument("--customers", type=int, default=10000)
+        parser.add_argument("--requests", type=int, default=500, help="Requests per scenario and concurrency level")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+        parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random ids and amounts")
+        parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout")
+        parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown as a fraction, default 0.25")
+
+    def handle(self, *args, **options):
+        with benchmark.test_database():
+            report = self.benchmark(options)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            regressions = benchmark.compare(report["results"], baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressed against the baseline:\n" + "\n".join(regressions))
+            self.stderr.write(self.style.SUCCESS("No regression against the baseline"))
+
+    def benchmark(self, options):
+        started = time.perf_counter()
+        benchmark.seed(options["merchants"], options["customers"])
+        seeded = time.perf_counter() - started
+
+        admin = services.create_account("bench-admin", None, is_superuser=True)
+        admin_token = f"{KEYWORD} {issue_key(admin)[1]}"
+        merchant_ids = list(Merchant.objects.order_by("id").values_list("id", flat=True))
+        customers = list(Customer.objects.select_related("user").order_by("id")[:100])
+        customer_tokens = [f"{KEYWORD} {issue_key(customer.user)[1]}" for customer in customers]
+        customer_ids = [customer.id for customer in customers]
+        created = itertools.count()
+
+        def list_page(client, rng):
+            return client.get("/api/merchants/", {"page_size": 100})
+
+        def detail(client, rng):
+            return client.get(f"/api/customers/{rng.choice(customer_ids)}/", HTTP_AUTHORIZATION=admin_token)
+
+        def create(client, rng):
+            return client.post(
+                "/api/customers/", {"username": f"bench-new-{next(created)}", "password": "benchmark"},
+                content_type="application/json", HTTP_AUTHORIZATION=admin_token)
+
+        def buy(client, rng):
+            return client.post(
+                f"/api/transaction/{rng.choice(merchant_ids)}/{rng.randint(1, 100)}/",
+                HTTP_AUTHORIZATION=rng.choice(customer_tokens))
+
+        def purchase(client, rng):
+            return client.post(
+                "/api/transactions/", {"merchant_id": rng.choice(merchant_ids), "amount": rng.randint(1, 100)},
+                content_type="application/json", HTTP_AUTHORIZATION=rng.choice(customer_tokens))
+
+        requests = {"list": list_page, "detail": detail, "create": create, "transaction": buy, "purchase": purchase}
+        results = []
+        for name in options["scenarios"]:
+            for concurrency in options["concurrency"]:
+                result = benchmark.run(requests[name], options["requests"], concurrency, seed=options["seed"])
+                result.update(scenario=name, concurrency=concurrency)
+                results.append(result)
+                self.stderr.write(
+                    f"{name:<12} c={concurrency:<4} {result['rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                    f"p99 {result['p99_ms']:8.2f} ms  {result['queries_per_request']:6.2f} queries  "
+                    f"{result['errors']} errors"
+                )
+
+        return {
+            "dataset": {
+                "merchants": options["merchants"],
+                "customers": options["customers"],
+                "seed_seconds": round(seeded, 2),
+                "database": connections["default"].vendor,
+            },
+            "results": results,
+        }
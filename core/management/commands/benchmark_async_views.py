@@ -0,0 +1,83 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+
+from core.benchmark import summarize
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests per second and p99 latency of a read endpoint served by the "
+        "sync DRF view through WSGI and by its async variant through ASGI, in process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Sync endpoint, e.g. /api/merchants/ or /api/customers/1/")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+        parser.add_argument("--token", default=None, help="API key for endpoints that need authentication")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        async_path = path.replace("/api/", "/api/async/", 1)
+        results = []
+        for concurrency in options["concurrency"]:
+            for name, run in (("wsgi", self.run_wsgi), ("asgi", self.run_asgi)):
+                target = path if name == "wsgi" else async_path
+                result = run(target, options["requests"], concurrency, options["token"])
+                result.update(server=name, path=target, concurrency=concurrency)
+                results.append(result)
+                if not options["json"]:
+                    self.stdout.write(
+                        f"{name}  c={concurrency:<4} {result['rps']:9.1f} req/s  "
+                        f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  {target}"
+                    )
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def run_wsgi(self, path, requests, concurrency, token):
+        local = threading.local()
+        headers = {"HTTP_AUTHORIZATION": f"Token {token}"} if token else {}
+
+        def fetch(_):
+            if not hasattr(local, "client"):
+                local.client = Client(**headers)
+            started = time.perf_counter()
+            response = local.client.get(path)
+            assert response.status_code < 400, f"{path} returned {response.status_code}"
+            return time.perf_counter() - started
+
+        def close(_):
+            connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(fetch, range(requests)))
+            list(executor.map(close, range(concurrency)))
+        return summarize(latencies, time.perf_counter() - started)
+
+    def run_asgi(self, path, requests, concurrency, token):
+        headers = {"authorization": f"Token {token}"} if token else {}
+
+        async def main():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def fetch():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.get(path, **headers)
+                    assert response.status_code < 400, f"{path} returned {response.status_code}"
+                    return time.perf_counter() - started
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*[fetch() for _ in range(requests)])
+            return summarize(latencies, time.perf_counter() - started)
+
+        return asyncio.run(main())
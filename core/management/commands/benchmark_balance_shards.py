@@ -0,0 +1,69 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from core import services, stats
+from core.models import Merchant
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent credit throughput to a single merchant for several shard counts. "
+        "Creates and removes a throwaway merchant, run it against a staging database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 4, 16])
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--credits", type=int, default=500, help="Credits per thread")
+
+    def handle(self, *args, **options):
+        user = services.create_account(f"bench-{uuid.uuid4().hex[:12]}", None, is_merchant=True)
+        merchant_id = user.merchant.id
+        try:
+            for shards in options["shards"]:
+                services.set_balance_shards(merchant_id, shards)
+                rate = self.run(merchant_id, options["threads"], options["credits"])
+                self.stdout.write(f"shards={shards:<4} threads={options['threads']:<4} {rate:10.1f} credits/s")
+
+            services.compact_balance_shards([merchant_id])
+            expected = len(options["shards"]) * options["threads"] * options["credits"]
+            balance = Merchant.objects.values_list("balance", flat=True).get(id=merchant_id)
+            if balance != expected:
+                self.stderr.write(self.style.ERROR(f"Balance {balance} doesn't match the {expected} credited"))
+        finally:
+            user.delete()
+
+    def run(self, merchant_id, threads, credits):
+        errors = []
+
+        def work():
+            credited = 0
+            try:
+                for _ in range(credits):
+                    with transaction.atomic():
+                        services.credit_merchant(merchant_id, 1)
+                    credited += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Recorded once per thread rather than per credit, so the
+                # counters' row locks don't skew the throughput measured.
+                try:
+                    stats.record(merchant_balance=credited)
+                finally:
+                    connections.close_all()
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - started
+
+        if errors:
+            raise errors[0]
+        return threads * credits / seconds
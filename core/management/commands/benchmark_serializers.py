@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import QueryDict
+
+from core import benchmark
+from core.filters import sparse_fieldset
+from core.models import Merchant
+from core.serializers import MerchantSerializer
+
+MODES = {
+    "full": "",
+    "compact": "compact=1",
+    "fields=id,balance": "fields=id,balance",
+}
+
+class Command(BaseCommand):
+    help = (
+        "Measure rows per second rendering the merchant list to JSON with MerchantSerializer, "
+        "the compact representation and a sparse fieldset, on a throwaway seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=3, help="Keep the best of this many runs")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        with benchmark.test_database():
+            benchmark.seed(options["rows"], 0)
+            results = [self.measure(mode, query, options["repeat"]) for mode, query in MODES.items()]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<20} {result['rows_per_second']:12.1f} rows/s  "
+                f"{result['seconds'] * 1000:9.1f} ms  {result['bytes']} bytes")
+
+    def measure(self, mode, query, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = Merchant.objects.select_related("user").with_shard_balance().order_by("id")
+            queryset, serializer_class = sparse_fieldset(queryset, MerchantSerializer, QueryDict(query))
+            rendered = json.dumps(serializer_class(queryset, many=True).data, cls=DjangoJSONEncoder)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+        rows = Merchant.objects.count()
+        return {
+            "mode": mode,
+            "rows": rows,
+            "seconds": round(best, 4),
+            "rows_per_second": round(rows / best, 1),
+            "bytes": len(rendered),
+        }
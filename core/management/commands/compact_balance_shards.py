@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import services
+
+class Command(BaseCommand):
+    help = "Fold pending balance shard credits into Merchant.balance, run it periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=None, help="Keep running, compacting every N seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            compacted = services.compact_balance_shards()
+            self.stdout.write(f"Compacted the balance shards of {compacted} merchants")
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core import schema
+
+class Command(BaseCommand):
+    help = "Pre-render the OpenAPI document for the current code version, run it at deploy time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", nargs="+", choices=list(schema.CODECS), default=list(schema.CODECS))
+
+    def handle(self, *args, **options):
+        for path in schema.write(kinds=options["format"]):
+            self.stdout.write(f"Wrote {path}")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import provisioning
+
+class Command(BaseCommand):
+    help = "Bulk create merchant and customer accounts from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File with username, password, role and optional balance per account")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=None, help="Password hashing processes, 0 hashes in process")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+
+        try:
+            with open(path, newline="", encoding="utf-8") as f:
+                summary = provisioning.import_accounts(
+                    provisioning.read_accounts(f, fmt),
+                    batch_size=options["batch_size"],
+                    workers=options["workers"],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        for error in summary["errors"]:
+            self.stderr.write(f"row {error['row']}: {error['username']!r} {error['detail']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']} accounts, {summary['failed']} failed, "
+            f"in {summary['seconds']}s ({summary['accounts_per_second']} accounts/s)"
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records older than IDEMPOTENCY_KEY_TTL"
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired idempotency keys"))
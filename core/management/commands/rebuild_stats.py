@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import stats
+
+class Command(BaseCommand):
+    help = "Recompute the /api/stats/ counters from the merchant and customer tables"
+
+    def handle(self, *args, **options):
+        totals = stats.rebuild()
+        for name, value in totals.items():
+            self.stdout.write(f"{name}: {value}")
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from core import settlement
+
+REPORT_INTERVAL = 10
+
+class Command(BaseCommand):
+    help = (
+        "Apply the pending merchant credits written while ASYNC_SETTLEMENT is on. "
+        "Keeps running until interrupted, or until the backlog is empty with --once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=getattr(settings, "SETTLEMENT_WORKERS", 1))
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "SETTLEMENT_BATCH_SIZE", 500))
+        parser.add_argument(
+            "--interval", type=float, default=getattr(settings, "SETTLEMENT_INTERVAL", 1.0),
+            help="Seconds to wait for new credits once the backlog is drained")
+        parser.add_argument("--once", action="store_true", help="Exit once the backlog is drained")
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.settled = 0
+        workers = [
+            threading.Thread(target=self.work, args=(options["batch_size"], options["interval"], options["once"]))
+            for _ in range(options["workers"])
+        ]
+        for worker in workers:
+            worker.start()
+
+        started = last_report = time.perf_counter()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(0.1)
+                if time.perf_counter() - last_report >= REPORT_INTERVAL:
+                    self.report(started)
+                    last_report = time.perf_counter()
+        except KeyboardInterrupt:
+            self.stop.set()
+        for worker in workers:
+            worker.join()
+        self.report(started)
+
+    def work(self, batch_size, interval, once):
+        try:
+            while not self.stop.is_set():
+                try:
+                    settled = settlement.settle_batch(batch_size)
+                except (settlement.AlreadySettled, OperationalError):
+                    # Raced with another worker, or SQLite was busy, claim again.
+                    self.stop.wait(0.01)
+                    continue
+                with self.lock:
+                    self.settled += settled
+                if settled < batch_size:
+                    if once:
+                        return
+                    self.stop.wait(interval)
+        finally:
+            connections.close_all()
+
+    def report(self, started):
+        backlog = settlement.backlog()
+        seconds = time.perf_counter() - started
+        self.stdout.write(
+            f"settled {self.settled} credits ({self.settled / seconds:.1f}/s), "
+            f"{backlog['count']} pending worth {backlog['amount']}, lag {backlog['lag_seconds']}s"
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import services
+from core.models import Merchant
+
+class Command(BaseCommand):
+    help = "Spread a merchant's balance credits over N shard rows, 0 switches sharding off"
+
+    def add_arguments(self, parser):
+        parser.add_argument("merchant_id", type=int)
+        parser.add_argument("shards", type=int)
+
+    def handle(self, *args, **options):
+        if options["shards"] < 0:
+            raise CommandError("shards must be 0 or more")
+        try:
+            services.set_balance_shards(options["merchant_id"], options["shards"])
+        except Merchant.DoesNotExist:
+            raise CommandError(f"Merchant {options['merchant_id']} does not exist")
+        self.stdout.write(self.style.SUCCESS(
+            f"Merchant {options['merchant_id']} now uses {options['shards']} balance shards"
+        ))
@@ -5,19 +5,26 @@ from rest_framework import generics
 from rest_framework import views
 from rest_framework import permissions
 
-from core.serializers import CreateUserSerializer, MerchantSerializer
-from core.models import Merchant
-from core.permissions import IsStaffOrReadOnly
+from core.serializers import USERNAME_TAKEN, CreateUserSerializer, MerchantSerializer, TransactionSerializer
+from core.models import Merchant, Transaction
+from core import services
+from core.cache import CachedRetrieveModelMixin
+from core.permissions import IsOwnerOrSuperuser, IsProfileOwnerOrSuperuser, IsStaffOrReadOnly
+from core.pagination import IdCursorPagination, TransactionCursorPagination, LIST_PARAMETERS, is_ndjson_export, stream_ndjson
+from core.filters import FILTER_PARAMETERS, filter_profiles, sparse_fieldset
 
 from drf_yasg.utils import swagger_auto_schema
+from django.http import Http404
 
 class MerchantList(views.APIView):
     permission_classes = [IsStaffOrReadOnly,]
 
     @swagger_auto_schema(
+        manual_parameters=LIST_PARAMETERS + FILTER_PARAMETERS,
         responses={
             200: MerchantSerializer(),
-            204: "No Content"
+            204: "No Content",
+            400: "Bad Request",
         }
     )
     def get(self, request):
@@ -25,9 +32,31 @@ class MerchantList(views.APIView):
         Merchant's List
 
         List all merchants, if 0 merchant exists return 204.
+        Pass search, min_balance and max_balance to filter by username prefix and balance,
+        and ordering (id, -id, balance, -balance) to sort, return 400 if they're invalid.
+        Balance filters and ordering use the balance without pending shard credits,
+        so a sharded merchant can be filtered or ranked below the balance it shows.
+        Pass compact=1, or fields with a subset of id, username and balance, to get flat objects.
+        Pass page_size and/or cursor to get a cursor paginated response.
+        Pass export=ndjson to stream every merchant as newline delimited JSON.
         """
-        merchant = Merchant.objects.all()
-        serializer = MerchantSerializer(merchant, many=True)
+        merchant, ordering = filter_profiles(Merchant.objects.select_related("user").with_shard_balance(), request.query_params)
+        merchant, serializer_class = sparse_fieldset(merchant, MerchantSerializer, request.query_params)
+        if is_ndjson_export(request):
+            if not merchant.exists():
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            return stream_ndjson(merchant, serializer_class)
+
+        paginator = IdCursorPagination()
+        paginator.ordering = ordering
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(merchant, request, view=self)
+            if not page:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            serializer = serializer_class(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        serializer = serializer_class(merchant, many=True)
         if not serializer.data:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(serializer.data)
@@ -51,25 +80,22 @@ class MerchantList(views.APIView):
         """
         serializer = CreateUserSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            user.is_merchant = True
-            user.set_password(serializer.data["password"])
-            user.save()
-
-            merchant = Merchant.objects.get(id=user.merchant.id)
-            merchant_serializer = MerchantSerializer(merchant)
-            return Response(merchant_serializer.data, status=status.HTTP_201_CREATED)
+            try:
+                user = services.create_account(is_merchant=True, **serializer.validated_data)
+            except services.UsernameTaken:
+                return Response({"username": [USERNAME_TAKEN]}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(MerchantSerializer(user.merchant).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class MerchantDetail(
-                    mixins.RetrieveModelMixin,
+                    CachedRetrieveModelMixin,
                     mixins.UpdateModelMixin,
                     mixins.DestroyModelMixin,
                     generics.GenericAPIView):
 
-    queryset = Merchant.objects.all()
+    queryset = Merchant.objects.select_related("user").with_shard_balance()
     serializer_class = MerchantSerializer
-    permission_classes = [permissions.IsAuthenticated,]
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrSuperuser,]
 
     @swagger_auto_schema(
         responses={
@@ -104,12 +130,7 @@ class MerchantDetail(
         Return 400 if request is invalid.
         Return 404 if no merchant found with that ID.
         """
-
-        if request.user.is_merchant and request.user.merchant.id == kwargs["pk"] or request.user.is_superuser:
-            return self.update(request, *args, **kwargs)
-        return Response(
-                {"detail": "Only Superuser or The Requested Account Can Perform This Action"},
-                status=status.HTTP_403_FORBIDDEN)
+        return self.update(request, *args, **kwargs)
 
     @swagger_auto_schema(
         responses={
@@ -126,9 +147,34 @@ class MerchantDetail(
         Return 204 with no content if merchant exists and deleted successfully.
         Return 404 if no merchant found with that ID.
         """
+        return self.destroy(request, *args, **kwargs)
+
+class MerchantTransactionList(mixins.ListModelMixin, generics.GenericAPIView):
+    serializer_class = TransactionSerializer
+    pagination_class = TransactionCursorPagination
+    permission_classes = [permissions.IsAuthenticated, IsProfileOwnerOrSuperuser,]
+    owner_role = "merchant"
+
+    def get_queryset(self):
+        if getattr(self, "swagger_fake_view", False):
+            return Transaction.objects.none()
+        return Transaction.objects.filter(merchant_id=self.kwargs["pk"])
 
-        if request.user.is_merchant and request.user.merchant.id == kwargs["pk"] or request.user.is_superuser:
-            return self.destroy(request, *args, **kwargs)
-        return Response(
-                {"detail": "Only Superuser or The Requested Account Can Perform This Action"},
-                status=status.HTTP_403_FORBIDDEN)
+    @swagger_auto_schema(
+        responses={
+            200: TransactionSerializer(many=True),
+            403: "Either You Aren't Authenticated Or You Didn't Have Permission To Request",
+            404: "Invalid Merchant's ID or Not Found"
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        """
+        Merchant's Transaction History
+
+        Can only be done by an admin account or by requested account, return 403 otherwise.
+        Return 200 with a cursor paginated list of transactions, newest first.
+        Return 404 if no merchant found with that ID.
+        """
+        if not Merchant.objects.filter(pk=kwargs["pk"]).exists():
+            raise Http404
+        return self.list(request, *args, **kwargs)
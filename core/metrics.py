@@ -0,0 +1,228 @@
+import bisect
+import logging
+import threading
+import time
+from collections import Counter as QueryCounter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from core.middleware import HybridMiddleware
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """
+    Thread safe Prometheus style histogram with a fixed set of labels,
+    kept in process memory.
+    """
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Non cumulative bucket counts, with +Inf last, then the sum.
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}_total{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class SettlementBacklog:
+    """
+    Gauges of the pending merchant credits, read from the database when
+    /metrics is scraped since the settlement worker runs in its own process.
+    """
+    def collect(self):
+        from core import settlement
+        backlog = settlement.backlog()
+        lines = []
+        for name, key, documentation in (
+            ("settlement_pending_credits", "count", "Merchant credits waiting for settlement."),
+            ("settlement_pending_amount", "amount", "Total amount of the merchant credits waiting for settlement."),
+            ("settlement_lag_seconds", "lag_seconds", "Age of the oldest merchant credit waiting for settlement."),
+        ):
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {backlog[key]}"])
+        return lines
+
+LABELS = ("method", "route")
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Wall time of a request, by route.", LABELS, DURATION_BUCKETS)
+request_queries = Histogram(
+    "http_request_db_queries", "Database queries made by a request, by route.", LABELS, QUERY_BUCKETS)
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Time a request spent in the database, by route.", LABELS, DURATION_BUCKETS)
+over_budget = Counter(
+    "http_requests_over_query_budget", "Requests that made more than METRICS_QUERY_BUDGET queries.", LABELS)
+
+REGISTRY = (request_duration, request_queries, request_db_duration, over_budget, SettlementBacklog())
+
+class QueryRecorder:
+    """
+    ``connection.execute_wrapper`` hook counting the queries of one request,
+    the time they took and how often each SQL statement was repeated.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = QueryCounter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+_recorder = ContextVar("query_recorder", default=None)
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection, handing the query to the
+    QueryRecorder of the current request if there is one. Being looked up
+    in a context variable, it also sees the queries made by sync_to_async
+    threads on their own connections.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+def route_of(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return "/" + match.route
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Record the wall time, query count and database time of every request in
+    per route histograms, served by metrics_view at /metrics.
+
+    Requests making more than METRICS_QUERY_BUDGET queries are logged as
+    warnings along with their most repeated statement, which is how an N+1
+    shows up. The histograms live in process memory, so each worker
+    reports its own.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.budget = getattr(settings, "METRICS_QUERY_BUDGET", 20)
+        # Connections opened before this module was loaded.
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+
+    def handle(self, request):
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self.observe(request, recorder, time.perf_counter() - started)
+        return response
+
+    async def ahandle(self, request):
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self.observe(request, recorder, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, recorder, duration):
+        labels = (request.method, route_of(request))
+        request_duration.observe(labels, duration)
+        request_queries.observe(labels, recorder.count)
+        request_db_duration.observe(labels, recorder.duration)
+
+        if self.budget is not None and recorder.count > self.budget:
+            over_budget.inc(labels)
+            statement, repeated = recorder.statements.most_common(1)[0]
+            logger.warning(
+                "%s %s made %d queries (budget %d) in %.1fms, %.1fms in the database; "
+                "repeated %d times: %s",
+                request.method, labels[1], recorder.count, self.budget, duration * 1000,
+                recorder.duration * 1000, repeated, statement,
+            )
+
+def metrics_view(request):
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,21 @@
+import asyncio
+
+from django.utils.deprecation import MiddlewareMixin
+
+class HybridMiddleware(MiddlewareMixin):
+    """
+    Base for middleware that wrap the whole request in both sync and async
+    middleware chains. Subclasses implement handle() and the coroutine
+    ahandle(), called with the request in the matching chain, instead of
+    MiddlewareMixin's hooks which it runs in a thread under ASGI.
+    """
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.ahandle(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def ahandle(self, request):
+        raise NotImplementedError
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.4 on 2026-10-18 15:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchant',
+            name='balance_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MerchantBalanceShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('balance', models.IntegerField(default=0)),
+                ('merchant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='balance_shard_set', to='core.merchant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='merchantbalanceshard',
+            constraint=models.UniqueConstraint(fields=('merchant', 'shard'), name='core_balance_shard_uniq'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.4 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_apikey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='balance',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='merchant',
+            name='balance',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['username'], name='core_user_username_like_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.4 on 2026-10-18 15:33
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def seed_counters(apps, schema_editor):
+    Merchant = apps.get_model('core', 'Merchant')
+    Customer = apps.get_model('core', 'Customer')
+    MerchantBalanceShard = apps.get_model('core', 'MerchantBalanceShard')
+    StatCounter = apps.get_model('core', 'StatCounter')
+
+    merchants = Merchant.objects.aggregate(count=Count('id'), balance=Sum('balance'))
+    customers = Customer.objects.aggregate(count=Count('id'), balance=Sum('balance'))
+    shard_balance = MerchantBalanceShard.objects.aggregate(balance=Sum('balance'))['balance'] or 0
+    StatCounter.objects.bulk_create([
+        StatCounter(name='merchant_count', shard=0, value=merchants['count']),
+        StatCounter(name='customer_count', shard=0, value=customers['count']),
+        StatCounter(name='merchant_balance', shard=0, value=(merchants['balance'] or 0) + shard_balance),
+        StatCounter(name='customer_balance', shard=0, value=customers['balance'] or 0),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='statcounter',
+            constraint=models.UniqueConstraint(fields=('name', 'shard'), name='core_stat_counter_uniq'),
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
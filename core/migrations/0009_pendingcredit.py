@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2026-10-18 15:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_statcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCredit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_credits', to='core.merchant')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.4 on 2026-10-18 15:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_pendingcredit'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='transaction',
+            name='idempotency_key',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.4 on 2026-10-18 16:07
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_remove_transaction_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='core_user_username_like_idx',
+        ),
+    ]
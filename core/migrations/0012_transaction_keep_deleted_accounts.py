@@ -0,0 +1,24 @@
+# Generated by Django 3.2.4 on 2026-10-18 16:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_remove_user_username_like_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='customer',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='transactions', to='core.customer'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='merchant',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='transactions', to='core.merchant'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.4 on 2026-10-18 16:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_prefixes(apps, schema_editor):
+    # Every key but the oldest of a shared prefix gets its id appended, so
+    # it can still be told apart and revoked on its own.
+    ApiKey = apps.get_model('core', 'ApiKey')
+    shared = ApiKey.objects.values('prefix').annotate(count=Count('id')).filter(count__gt=1).values_list('prefix', flat=True)
+    for prefix in list(shared):
+        for api_key in ApiKey.objects.filter(prefix=prefix).order_by('id')[1:]:
+            api_key.prefix = f'{prefix}-{api_key.id}'
+            api_key.save(update_fields=['prefix'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_transaction_keep_deleted_accounts'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_prefixes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='apikey',
+            name='prefix',
+            field=models.CharField(max_length=16, unique=True),
+        ),
+    ]
@@ -1,27 +1,32 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
-class UserManager(BaseUserManager):
-    def create_user(self, username, is_merchant, is_customer, password=None, **kwargs):
-        if not username:
-            raise ValueError("Data is not complete")
+from core.cache import invalidate_detail, invalidate_owner_details
+
+class UserQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Delete the users together with their profiles through
+        core.services.delete_users, which keeps the stats counters and the
+        caches in step.
+        """
+        from core.services import delete_users
+        return delete_users(self.values_list("id", flat=True))
 
-        if is_merchant == is_customer and not kwargs["is_superuser"]:
-            raise ValidationError("A user must either be merchant or customer or a superuser")
+    delete.alters_data = True
+    delete.queryset_only = True
 
-        user = self.model(username=username, is_merchant=is_merchant, is_customer=is_customer, **kwargs)
-        user.set_password(password)
-        user.save()
-        return user
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    def create_user(self, username, is_merchant, is_customer, password=None, **kwargs):
+        from core.services import create_account
+        return create_account(username, password, is_merchant=is_merchant, is_customer=is_customer, **kwargs)
 
     def create_superuser(self, username, is_merchant, is_customer, password):
-        user = self.create_user(username=username, is_merchant=is_merchant, is_customer=is_customer, password=password, is_superuser=True)
-        user.is_superuser = True
-        user.save()
-        return user
+        return self.create_user(username=username, is_merchant=is_merchant, is_customer=is_customer, password=password, is_superuser=True)
 
 class User(AbstractBaseUser):
     username = models.CharField(max_length=255, unique=True)
@@ -38,6 +43,10 @@ class User(AbstractBaseUser):
     def __str__(self):
         return self.username or ""
 
+    def delete(self, using=None, keep_parents=False):
+        from core.services import delete_users
+        return delete_users([self.pk])
+
     def has_perm(self, perm, obj=None):
         return True
 
@@ -48,36 +57,201 @@ class User(AbstractBaseUser):
     def is_staff(self):
         return self.is_superuser
 
-class Merchant(models.Model):
+class ProfileQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Delete the profiles together with their users in set based
+        statements, see core.services.delete_users.
+        """
+        from core.services import delete_profiles
+        return delete_profiles(self)
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+class ProfileModel(models.Model):
+    def delete(self, using=None, keep_parents=False):
+        from core.services import delete_users
+        return delete_users([self.user_id])
+
+    class Meta:
+        abstract = True
+
+class MerchantQuerySet(ProfileQuerySet):
+    def with_shard_balance(self):
+        """
+        Annotate ``shard_balance``, the credits sitting in balance shards that
+        haven't been compacted into ``balance`` yet. Unsharded merchants skip
+        the subquery.
+        """
+        shard_total = (
+            MerchantBalanceShard.objects
+            .filter(merchant=models.OuterRef("pk"))
+            .values("merchant")
+            .annotate(total=models.Sum("balance"))
+            .values("total")
+        )
+        return self.annotate(shard_balance=models.Case(
+            models.When(balance_shards=0, then=models.Value(0)),
+            default=Coalesce(models.Subquery(shard_total), models.Value(0)),
+            output_field=models.IntegerField(),
+        ))
+
+class Merchant(ProfileModel):
     user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name="merchant", default=None)
-    balance = models.IntegerField()
+    balance = models.IntegerField(db_index=True)
+    balance_shards = models.PositiveSmallIntegerField(default=0)
+
+    objects = MerchantQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
 
-class Customer(models.Model):
+class MerchantBalanceShard(models.Model):
+    """
+    One of ``Merchant.balance_shards`` sub-counters that take the credits of
+    a high volume merchant, so concurrent purchases don't all wait on the
+    merchant row lock. The merchant's balance is ``balance`` plus its shards.
+    """
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE, related_name="balance_shard_set", db_index=False)
+    shard = models.PositiveSmallIntegerField()
+    balance = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["merchant", "shard"], name="core_balance_shard_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.merchant_id}#{self.shard}"
+
+class Customer(ProfileModel):
     user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name="customer", default=None)
-    balance = models.IntegerField()
+    balance = models.IntegerField(db_index=True)
+
+    objects = ProfileQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
 
+class Transaction(models.Model):
+    # The ledger keeps the ids of deleted accounts for reconciliation, so
+    # there's no constraint and deleting a profile doesn't touch its rows.
+    customer = models.ForeignKey(Customer, on_delete=models.DO_NOTHING, db_constraint=False, related_name="transactions", null=True, db_index=False)
+    merchant = models.ForeignKey(Merchant, on_delete=models.DO_NOTHING, db_constraint=False, related_name="transactions", null=True, db_index=False)
+    amount = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["customer", "created"], name="core_tx_customer_created_idx"),
+            models.Index(fields=["merchant", "created"], name="core_tx_merchant_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} -> {self.merchant_id}: {self.amount}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Transactions are append-only and can't be modified")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Transactions are append-only and can't be deleted")
+
+class PendingCredit(models.Model):
+    """
+    A merchant credit waiting to be applied by the settlement worker, written
+    in the customer's transaction when ASYNC_SETTLEMENT is on, see
+    core.settlement.
+    """
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE, related_name="pending_credits")
+    amount = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.merchant_id}: {self.amount}"
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="idempotency_keys", db_index=False)
+    key = models.CharField(max_length=128)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="core_idempotency_user_key_uniq"),
+        ]
+
+    def __str__(self):
+        return self.key
+
+class ApiKey(models.Model):
+    """
+    An API key for token authentication. Only a SHA-256 hash of the key is
+    stored; keys are random enough that a slow password hash isn't needed.
+    """
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="api_keys")
+    name = models.CharField(max_length=255, blank=True)
+    # Identifies the key to operators, e.g. to revoke it, so it's unique.
+    prefix = models.CharField(max_length=16, unique=True)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.prefix
+
+class StatCounter(models.Model):
+    """
+    One shard of a running total served by /api/stats/, such as the number
+    of merchants or the sum of customer balances. A total is the sum of its
+    shards, see core.stats.
+    """
+    name = models.CharField(max_length=32)
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["name", "shard"], name="core_stat_counter_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.name}#{self.shard}"
+
 @receiver(models.signals.post_save, sender=User)
-def auto_create_extended_object(sender, instance, created, **kwargs):
+def auto_create_extended_object(sender, instance, created, update_fields=None, **kwargs):
+    # Profiles made by core.services.create_account are inserted there already.
+    if getattr(instance, "_profile_created", False):
+        return
+    if update_fields is not None and not {"is_merchant", "is_customer"} & set(update_fields):
+        return
+
+    from core import stats
     if instance.is_merchant:
-        Merchant.objects.get_or_create(user=instance, defaults={
+        _, inserted = Merchant.objects.get_or_create(user=instance, defaults={
             'balance': 0,
         })
+        if inserted:
+            stats.record(merchant_count=1)
 
     if instance.is_customer:
-        Customer.objects.get_or_create(user=instance, defaults={
+        _, inserted = Customer.objects.get_or_create(user=instance, defaults={
             'balance': 0,
         })
+        if inserted:
+            stats.record(customer_count=1)
 
-@receiver(models.signals.post_delete, sender=Merchant)
-def auto_delete_user(sender, instance, **kwargs):
-    User.objects.get(id=instance.user.id).delete()
+@receiver(models.signals.post_save, sender=Merchant)
+@receiver(models.signals.post_save, sender=Customer)
+def invalidate_profile_detail(sender, instance, **kwargs):
+    invalidate_detail(sender, instance.pk)
 
-@receiver(models.signals.post_delete, sender=Customer)
-def auto_delete_user2(sender, instance, **kwargs):
-    User.objects.get(id=instance.user.id).delete()
+@receiver(models.signals.post_save, sender=User)
+def invalidate_user_details(sender, instance, created, **kwargs):
+    if not created:
+        from core.authentication import principals
+        invalidate_owner_details(instance.pk, Merchant, Customer)
+        # Cached API key principals carry the roles and profile ids.
+        transaction.on_commit(lambda: principals.discard_users([instance.pk]))
@@ -0,0 +1,70 @@
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from drf_yasg import openapi
+from rest_framework.pagination import CursorPagination
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key.
+
+    Pages are fetched with ``WHERE id > <cursor>`` so the cost of a page does
+    not depend on how deep into the table the client is. Views may set
+    ``ordering`` to another indexed column (see core.filters), ties on it
+    are then skipped over by offset.
+    """
+    ordering = "id"
+    page_size = getattr(settings, "LIST_PAGE_SIZE", 100)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "LIST_MAX_PAGE_SIZE", 1000)
+
+    def is_requested(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
+
+class TransactionCursorPagination(CursorPagination):
+    """
+    Newest first keyset pagination over a customer's or merchant's ledger,
+    served by the (customer, created) and (merchant, created) indexes.
+    """
+    ordering = "-created"
+    page_size = getattr(settings, "LIST_PAGE_SIZE", 100)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "LIST_MAX_PAGE_SIZE", 1000)
+
+LIST_PARAMETERS = [
+    openapi.Parameter("cursor", openapi.IN_QUERY, "Opaque cursor returned as next/previous by a paginated response.", type=openapi.TYPE_STRING),
+    openapi.Parameter("page_size", openapi.IN_QUERY, "Number of results per page, enables cursor pagination.", type=openapi.TYPE_INTEGER),
+    openapi.Parameter("export", openapi.IN_QUERY, "Set to ndjson to stream every row as newline delimited JSON.", type=openapi.TYPE_STRING, enum=["ndjson"]),
+]
+
+def is_ndjson_export(request):
+    return request.query_params.get("export") == "ndjson"
+
+def stream_ndjson(queryset, serializer_class, chunk_size=None):
+    """
+    Stream a queryset as newline delimited JSON, one object per line.
+
+    Rows are read with ``.iterator()`` and serialized one chunk at a time,
+    so peak memory is bounded by ``chunk_size`` instead of the table size.
+    Rows come out in the queryset's ordering, by id if it has none.
+    """
+    chunk_size = chunk_size or getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+    if not queryset.ordered:
+        queryset = queryset.order_by("id")
+    rows = queryset.iterator(chunk_size=chunk_size)
+
+    def lines():
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            for data in serializer_class(chunk, many=True).data:
+                yield json.dumps(data, cls=DjangoJSONEncoder) + "\n"
+
+    return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
@@ -5,4 +5,38 @@ class IsStaffOrReadOnly(BasePermission):
         if request.method in SAFE_METHODS:
             return True
         
-        return request.user.is_superuser
\ No newline at end of file
+        return request.user.is_superuser
+
+class IsOwnerOrSuperuser(BasePermission):
+    """
+    Object level permission for merchants and customers: anyone may read,
+    only a superuser or the account the object belongs to may change it.
+    Ownership is read from the fetched object's user_id, so no profile has
+    to be loaded for the requesting user.
+    """
+    message = "Only Superuser or The Requested Account Can Perform This Action"
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in SAFE_METHODS:
+            return True
+
+        return request.user.is_superuser or obj.user_id == request.user.id
+
+class IsProfileOwnerOrSuperuser(BasePermission):
+    """
+    View level permission for the sub resources of a merchant or customer,
+    like its transactions: only a superuser or the account whose
+    ``view.owner_role`` profile has the ``pk`` of the URL may see them. The
+    profile id comes from the request user, so no query is made.
+    """
+    message = IsOwnerOrSuperuser.message
+
+    def has_permission(self, request, view):
+        if request.user.is_superuser:
+            return True
+
+        role = view.owner_role
+        if not getattr(request.user, f"is_{role}", False):
+            return False
+        profile = getattr(request.user, role, None)
+        return profile is not None and profile.id == view.kwargs["pk"]
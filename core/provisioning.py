@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from core import stats
+from core.models import Customer, Merchant, User
+from core.serializers import INTEGER_MAX
+
+ROLES = {"merchant": Merchant, "customer": Customer}
+USERNAME_MAX_LENGTH = User._meta.get_field("username").max_length
+
+def read_accounts(stream, fmt):
+    """
+    Yield account dicts from a text stream of CSV (with a header row) or JSONL.
+    Lines are parsed lazily so the file is never held in memory as a whole.
+    A JSONL line that isn't valid JSON is yielded as its JSONDecodeError, so
+    it's reported as an invalid row like the others.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield e
+    else:
+        raise ValueError(f"Unsupported format {fmt!r}, expected csv or jsonl")
+
+def decode_lines(binary, encoding="utf-8"):
+    for line in binary:
+        yield line.decode(encoding)
+
+def _clean(row, account, seen):
+    if isinstance(account, json.JSONDecodeError):
+        return None, {"row": row, "username": "", "detail": f"Invalid JSON: {account.msg}"}
+    if not isinstance(account, dict):
+        return None, {"row": row, "username": "", "detail": "Account must be a JSON object"}
+
+    username = account.get("username")
+    username = username.strip() if isinstance(username, str) else ""
+    password = account.get("password") or ""
+    role = account.get("role")
+    role = role.strip().lower() if isinstance(role, str) else ""
+    balance = account.get("balance") or 0
+
+    if not username or len(username) > USERNAME_MAX_LENGTH:
+        return None, {"row": row, "username": username, "detail": "Invalid username"}
+    if username in seen:
+        return None, {"row": row, "username": username, "detail": "Duplicate username"}
+    if not password:
+        return None, {"row": row, "username": username, "detail": "Password is required"}
+    if not isinstance(password, str):
+        return None, {"row": row, "username": username, "detail": "Password must be a string"}
+    if role not in ROLES:
+        return None, {"row": row, "username": username, "detail": "Role must be merchant or customer"}
+    try:
+        balance = int(balance)
+    except (TypeError, ValueError, OverflowError):
+        balance = -1
+    # Above INTEGER_MAX the balance column overflows and the whole batch fails.
+    if not 0 <= balance <= INTEGER_MAX:
+        return None, {"row": row, "username": username, "detail": "Invalid balance"}
+    return (username, password, role, balance), None
+
+def _create_batch(batch, executor):
+    usernames = [username for username, _, _, _ in batch]
+    taken = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+    batch = [account for account in batch if account[0] not in taken]
+
+    passwords = [password for _, password, _, _ in batch]
+    if executor is not None:
+        hashed = list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // 64)))
+    else:
+        hashed = [make_password(password) for password in passwords]
+
+    users = [
+        User(username=username, password=password_hash, is_merchant=role == "merchant", is_customer=role == "customer")
+        for (username, _, role, _), password_hash in zip(batch, hashed)
+    ]
+    with transaction.atomic():
+        # bulk_create doesn't send post_save, so auto_create_extended_object is
+        # bypassed and the profile rows are inserted in bulk below instead.
+        User.objects.bulk_create(users)
+        if any(user.pk is None for user in users):
+            ids = dict(User.objects.filter(username__in=[user.username for user in users]).values_list("username", "id"))
+            for user in users:
+                user.pk = ids[user.username]
+
+        for role, model in ROLES.items():
+            profiles = model.objects.bulk_create([
+                model(user_id=user.pk, balance=balance)
+                for user, (_, _, account_role, balance) in zip(users, batch)
+                if account_role == role
+            ])
+            stats.record(**{
+                f"{role}_count": len(profiles),
+                f"{role}_balance": sum(profile.balance for profile in profiles),
+            })
+    return len(users), sorted(taken)
+
+def _workers():
+    workers = getattr(settings, "ACCOUNT_IMPORT_WORKERS", None)
+    return os.cpu_count() if workers is None else workers
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def shared_executor():
+    """
+    Return the password hashing pool shared by every import made over HTTP,
+    started on first use and kept for the life of the process, so requests
+    don't each fork their own. None if ACCOUNT_IMPORT_WORKERS is 0.
+    """
+    global _executor
+    workers = _workers()
+    if not workers:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+        return _executor
+
+def import_accounts(accounts, batch_size=None, workers=None, executor=None):
+    """
+    Create merchant and customer accounts from an iterable of dicts with
+    username, password, role and an optional balance.
+
+    Accounts are handled ``batch_size`` at a time. Passwords are hashed in
+    ``executor`` if given, otherwise in a process pool of ``workers``
+    processes started for this import (no pool if workers is 0). Each batch
+    is then inserted with one bulk_create per table inside a transaction.
+    Rows that are invalid or whose username already exists are reported and
+    skipped. Returns a summary with the created count, the errors and the
+    throughput.
+    """
+    batch_size = batch_size or getattr(settings, "ACCOUNT_IMPORT_BATCH_SIZE", 1000)
+    if workers is None:
+        workers = _workers()
+
+    started = time.perf_counter()
+    created, errors, seen = 0, [], set()
+    numbered = enumerate(accounts, start=1)
+    owned = executor is None and workers
+    if owned:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+    try:
+        while True:
+            chunk = list(islice(numbered, batch_size))
+            if not chunk:
+                break
+
+            batch, rows = [], {}
+            for row, account in chunk:
+                cleaned, error = _clean(row, account, seen)
+                if error:
+                    errors.append(error)
+                    continue
+                seen.add(cleaned[0])
+                rows[cleaned[0]] = row
+                batch.append(cleaned)
+
+            batch_created, taken = _create_batch(batch, executor)
+            created += batch_created
+            errors.extend(
+                {"row": rows[username], "username": username, "detail": "Username already exists"}
+                for username in taken
+            )
+    finally:
+        if owned:
+            executor.shutdown()
+
+    seconds = time.perf_counter() - started
+    return {
+        "created": created,
+        "failed": len(errors),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "accounts_per_second": round(created / seconds, 1) if seconds else None,
+    }
@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+
+import django
+import drf_yasg
+import rest_framework
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import _SpecRenderer
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions, status
+from rest_framework.response import Response
+
+INFO = openapi.Info(
+    title='Bill Indonesia Interview Test',
+    default_version='v1',
+    description='REST API for Bill Indonesia Interview Test',
+)
+
+CODECS = {"json": OpenAPICodecJson, "yaml": OpenAPICodecYaml}
+
+def _source_files(root):
+    for directory, dirnames, filenames in os.walk(root):
+        # Skip hidden directories, caches and virtualenvs.
+        if "pyvenv.cfg" in filenames:
+            dirnames[:] = []
+            continue
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith(".") and name != "__pycache__")
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                yield os.path.join(directory, filename)
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    The SCHEMA_VERSION setting, or a hash of the project's Python sources and
+    of the versions of the libraries that shape the schema.
+    """
+    version = getattr(settings, "SCHEMA_VERSION", None)
+    if version:
+        return version
+    digest = hashlib.sha256(f"{django.__version__} {rest_framework.__version__} {drf_yasg.__version__}".encode())
+    for path in _source_files(settings.BASE_DIR):
+        digest.update(os.path.relpath(path, settings.BASE_DIR).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def _cache_dir():
+    return getattr(settings, "SCHEMA_CACHE_DIR", os.path.join(settings.BASE_DIR, ".schema_cache"))
+
+def _path(version, kind):
+    return os.path.join(_cache_dir(), f"openapi-{version}.{kind}")
+
+def generate():
+    """
+    Generate the OpenAPI document of every public endpoint, without a request.
+    """
+    return OpenAPISchemaGenerator(INFO).get_schema(request=None, public=True)
+
+def write(version=None, kinds=tuple(CODECS)):
+    """
+    Generate the document and store it on disk in each of ``kinds``.
+    Returns the paths.
+    """
+    version = version or code_version()
+    schema = generate()
+    os.makedirs(_cache_dir(), exist_ok=True)
+    paths = []
+    for kind in kinds:
+        path = _path(version, kind)
+        # Write then rename, so concurrent readers never see a partial file.
+        fd, tmp = tempfile.mkstemp(dir=_cache_dir())
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(CODECS[kind]([]).encode(schema))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        paths.append(path)
+    return paths
+
+_documents = {}
+_lock = threading.Lock()
+
+def get_document(kind):
+    """
+    Return the (document, etag) of the schema in ``kind`` (json or yaml)
+    for the current code version, from memory, then from disk, generating
+    and storing it only when neither has it.
+    """
+    version = code_version()
+    entry = _documents.get((version, kind))
+    if entry is not None:
+        return entry
+
+    with _lock:
+        entry = _documents.get((version, kind))
+        if entry is None:
+            path = _path(version, kind)
+            if not os.path.exists(path):
+                write(version, [kind])
+            with open(path, "rb") as f:
+                entry = _documents[(version, kind)] = (f.read(), f'"{version}-{kind}"')
+    return entry
+
+class CachedSchemaView(get_schema_view(INFO, public=True, permission_classes=(permissions.AllowAny,))):
+    """
+    Schema view serving the pre-rendered document of get_document with an
+    ETag, instead of introspecting every view on each request. The docs UI
+    page is rendered from an empty document, it only needs the title and
+    loads the schema itself from ``?format=openapi``.
+    """
+    def get(self, request, version='', format=None):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, _SpecRenderer):
+            return Response(openapi.Swagger(info=INFO, _prefix='/', _version=request.version or version or '', paths=openapi.Paths({})))
+
+        document, etag = get_document("yaml" if renderer.codec_class is OpenAPICodecYaml else "json")
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(document, content_type=f"{renderer.media_type}; charset=utf-8")
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        return response
@@ -1,10 +1,22 @@
+from functools import cached_property
+
 from rest_framework import serializers
-from core.models import User, Merchant, Customer
+from django.db import transaction
+from core.models import User, Merchant, Customer, Transaction
+from core import services
+
+USERNAME_TAKEN = "user with this username already exists."
+
+# Range of an IntegerField on every supported database.
+INTEGER_MIN = -2 ** 31
+INTEGER_MAX = 2 ** 31 - 1
 
 class CreateUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('username', 'password')
+        # Uniqueness is enforced by the insert itself, see core.services.create_account.
+        extra_kwargs = {'username': {'validators': []}}
 
 
 class SafeUserSerializer(serializers.ModelSerializer):
@@ -13,23 +25,100 @@ class SafeUserSerializer(serializers.ModelSerializer):
         exclude = ("password",)
 
 class MerchantSerializer(serializers.ModelSerializer):
-    user =  serializers.SerializerMethodField()
+    user = SafeUserSerializer(read_only=True)
+
+    def to_representation(self, merchant):
+        data = super().to_representation(merchant)
+        data["balance"] += getattr(merchant, "shard_balance", 0)
+        return data
 
-    def get_user(self, merchant):
-        qs = User.objects.get(id=merchant.user.id)
-        return SafeUserSerializer(instance=qs).data
+    def update(self, merchant, validated_data):
+        # The new balance replaces whatever is pending in the balance shards.
+        with transaction.atomic():
+            if "balance" in validated_data:
+                services.replace_balance(merchant, validated_data["balance"])
+            return super().update(merchant, validated_data)
 
     class Meta:
         model = Merchant
         fields = ("id", "user", "balance")
 
 class CustomerSerializer(serializers.ModelSerializer):
-    user =  serializers.SerializerMethodField()
+    user = SafeUserSerializer(read_only=True)
 
-    def get_user(self, merchant):
-        qs = User.objects.get(id=merchant.user.id)
-        return SafeUserSerializer(instance=qs).data
+    def update(self, customer, validated_data):
+        with transaction.atomic():
+            if "balance" in validated_data:
+                services.replace_balance(customer, validated_data["balance"])
+            return super().update(customer, validated_data)
 
     class Meta:
         model = Customer
         fields = ("id", "user", "balance")
+
+COMPACT_FIELDS = ("id", "username", "balance")
+
+class CompactSerializer:
+    """
+    Flat {"id", "username", "balance"} representation of merchants or
+    customers, for large lists. Takes ``.values()`` rows from
+    core.filters.sparse_fieldset rather than instances, so there are no
+    model or per field serializer objects per row. Pending shard credits
+    are folded into a merchant's balance like MerchantSerializer does.
+    """
+    def __init__(self, instance, many=False, fields=COMPACT_FIELDS):
+        self.instance = instance
+        self.many = many
+        self.fields = fields
+
+    def to_representation(self, row):
+        values = {}
+        for field in self.fields:
+            if field == "username":
+                values[field] = row["user__username"]
+            elif field == "balance":
+                values[field] = row["balance"] + row.get("shard_balance", 0)
+            else:
+                values[field] = row[field]
+        return values
+
+    @cached_property
+    def data(self):
+        if self.many:
+            return [self.to_representation(row) for row in self.instance]
+        return self.to_representation(self.instance)
+
+class TransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        fields = ("id", "customer", "merchant", "amount", "created")
+
+class BulkTransactionItemSerializer(serializers.Serializer):
+    merchant_id = serializers.IntegerField(min_value=1, max_value=INTEGER_MAX)
+    price = serializers.IntegerField(min_value=1, max_value=INTEGER_MAX)
+
+PURCHASE_FIELDS = ("merchant_id", "amount")
+
+def validate_purchase(data):
+    """
+    Validate a {"merchant_id": ..., "amount": ...} purchase body. A plain
+    function rather than a serializer, since it runs on every purchase.
+    Returns ((merchant_id, amount), errors) with errors shaped like a
+    serializer's, empty if the body is valid.
+    """
+    if not isinstance(data, dict):
+        return (None, None), {"non_field_errors": ["Invalid data. Expected a dictionary."]}
+
+    values, errors = [], {}
+    for field in PURCHASE_FIELDS:
+        value = data.get(field)
+        if isinstance(value, str) and value.isascii() and value.isdigit():
+            value = int(value)
+        if value is None:
+            errors[field] = ["This field is required."]
+        elif type(value) is not int or value < 1:
+            errors[field] = ["Ensure this value is a positive integer."]
+        elif value > INTEGER_MAX:
+            errors[field] = [f"Ensure this value is less than or equal to {INTEGER_MAX}."]
+        values.append(value)
+    return tuple(values), errors
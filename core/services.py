@@ -0,0 +1,360 @@
+import random
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Value, When
+
+from core import stats
+from core.authentication import principals
+from core.cache import invalidate_detail
+from core.models import Customer, Merchant, MerchantBalanceShard, PendingCredit, Transaction, User
+
+class InsufficientBalance(Exception):
+    pass
+
+class BalanceChanged(Exception):
+    pass
+
+class UsernameTaken(Exception):
+    pass
+
+def create_account(username, password, is_merchant=False, is_customer=False, **extra_fields):
+    """
+    Create a user and its merchant or customer profile.
+
+    The password is hashed once and both rows are inserted in one transaction,
+    without the get_or_create of auto_create_extended_object, along with the
+    /api/stats/ counter update: three statements plus BEGIN. The profile is
+    reachable as ``user.merchant`` / ``user.customer`` with its ``user``
+    already attached, so it can be serialized without another query.
+
+    Raises UsernameTaken if the username exists.
+    """
+    if not username:
+        raise ValueError("Data is not complete")
+
+    if is_merchant == is_customer and not extra_fields.get("is_superuser"):
+        raise ValidationError("A user must either be merchant or customer or a superuser")
+
+    user = User(username=username, is_merchant=is_merchant, is_customer=is_customer, **extra_fields)
+    user.set_password(password)
+    try:
+        with transaction.atomic():
+            user._profile_created = True
+            user.save(force_insert=True)
+            del user._profile_created
+            if is_merchant:
+                Merchant.objects.create(user=user, balance=0)
+            if is_customer:
+                Customer.objects.create(user=user, balance=0)
+            stats.record(merchant_count=int(is_merchant), customer_count=int(is_customer))
+    except IntegrityError:
+        if User.objects.filter(username=username).exists():
+            raise UsernameTaken
+        raise
+    return user
+
+def _supports_update_returning():
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+def _debit(customer_id, price):
+    """
+    Take ``price`` off a customer's balance only if it is covered.
+
+    The funds check and the write are one conditional UPDATE, so concurrent
+    purchases can never overdraw the balance. Returns the new balance, or
+    None if the customer can't afford it.
+    """
+    if _supports_update_returning():
+        table = connection.ops.quote_name(Customer._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET balance = balance - %s "
+                f"WHERE id = %s AND balance >= %s RETURNING balance",
+                [price, customer_id, price],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    debited = Customer.objects.filter(id=customer_id, balance__gte=price).update(balance=F("balance") - price)
+    if not debited:
+        return None
+    return Customer.objects.values_list("balance", flat=True).get(id=customer_id)
+
+def delete_users(user_ids):
+    """
+    Delete users together with their merchant and customer profiles.
+
+    Profiles have no per row delete signals, so Django's collector removes
+    everything with ``DELETE ... WHERE ... IN (...)`` statements, a handful
+    per batch no matter how many accounts go. Returns the same
+    (count, per model counts) as QuerySet.delete().
+    """
+    user_ids = list(user_ids)
+    with transaction.atomic():
+        merchants = list(
+            Merchant.objects.filter(user_id__in=user_ids).with_shard_balance()
+            .select_for_update(of=("self",)).values_list("id", "balance", "shard_balance")
+        )
+        customers = list(Customer.objects.filter(user_id__in=user_ids).select_for_update().values_list("id", "balance"))
+        pending = PendingCredit.objects.filter(merchant__user_id__in=user_ids).aggregate(total=models.Sum("amount"))["total"]
+        # QuerySet.delete() itself, User.objects...delete() comes back here.
+        deleted = models.QuerySet.delete(User.objects.filter(id__in=user_ids))
+        stats.record(
+            merchant_count=-len(merchants),
+            customer_count=-len(customers),
+            merchant_balance=-sum(balance + shard_balance for _, balance, shard_balance in merchants) - (pending or 0),
+            customer_balance=-sum(balance for _, balance in customers),
+        )
+        invalidate_detail(Merchant, *[merchant_id for merchant_id, _, _ in merchants])
+        invalidate_detail(Customer, *[customer_id for customer_id, _ in customers])
+        transaction.on_commit(lambda: principals.discard_users(user_ids))
+    return deleted
+
+def delete_profiles(queryset):
+    """
+    Delete the merchants or customers of a queryset along with their users.
+    """
+    with transaction.atomic():
+        return delete_users(queryset.values_list("user_id", flat=True))
+
+def replace_balance(profile, balance):
+    """
+    Prepare overwriting a merchant's or customer's balance, the caller saves
+    ``profile`` in the same transaction.
+
+    The profile row is locked and its current balance, plus any pending
+    shard credits which are dropped, is read back so the difference can be
+    recorded in the stats. A merchant's row is locked before its shards,
+    like compact_balance_shards() does.
+    """
+    model = type(profile)
+    previous = model.objects.select_for_update().values_list("balance", flat=True).get(pk=profile.pk)
+    if model is Merchant:
+        shards = MerchantBalanceShard.objects.select_for_update().filter(merchant_id=profile.pk)
+        previous += sum(shards.values_list("balance", flat=True))
+        shards.update(balance=0)
+        profile.shard_balance = 0
+        stats.record(merchant_balance=balance - previous)
+    else:
+        stats.record(customer_balance=balance - previous)
+    profile.balance = balance
+
+def credit_merchant(merchant_id, amount):
+    """
+    Add ``amount`` to a merchant's balance. Returns False if it doesn't exist.
+
+    Unsharded merchants are credited with one UPDATE. Sharded merchants
+    (balance_shards > 0) are credited on a random shard row instead, so
+    concurrent credits to the same merchant spread over several row locks.
+    The merchant row itself always remains a valid place for a credit, so it
+    is used as a fallback if the shards changed underneath.
+
+    The stats counters aren't touched, callers record the credit with
+    stats.record() in the same transaction, as transfer() does.
+    """
+    if Merchant.objects.filter(id=merchant_id, balance_shards=0).update(balance=F("balance") + amount):
+        return True
+
+    shards = Merchant.objects.filter(id=merchant_id).values_list("balance_shards", flat=True).first()
+    if shards is None:
+        return False
+    if shards and MerchantBalanceShard.objects.filter(
+        merchant_id=merchant_id, shard=random.randrange(shards)
+    ).update(balance=F("balance") + amount):
+        return True
+    return bool(Merchant.objects.filter(id=merchant_id).update(balance=F("balance") + amount))
+
+def credit_merchants(credits):
+    """
+    Credit several merchants at once, ``credits`` maps merchant ids to
+    amounts. Unsharded merchants are credited with one CASE update, sharded
+    ones through credit_merchant. Returns the number of merchants credited.
+    """
+    credited = Merchant.objects.filter(id__in=credits, balance_shards=0).update(balance=F("balance") + Case(
+        *[When(id=merchant_id, then=Value(amount)) for merchant_id, amount in credits.items()],
+        output_field=models.IntegerField(),
+    ))
+    if credited < len(credits):
+        sharded = Merchant.objects.filter(id__in=credits).exclude(balance_shards=0).values_list("id", flat=True)
+        for merchant_id in sharded:
+            if credit_merchant(merchant_id, credits[merchant_id]):
+                credited += 1
+    return credited
+
+def compact_balance_shards(merchant_ids=None):
+    """
+    Fold the credits sitting in balance shards into ``Merchant.balance``.
+
+    Each shard is decreased by the amount that was read rather than reset to
+    zero, so credits landing during compaction are never lost. Returns the
+    number of merchants compacted.
+
+    Merchant rows are locked before their shards, in the same order as
+    replace_balance() and set_balance_shards(), so they can't deadlock.
+    """
+    shards = MerchantBalanceShard.objects.exclude(balance=0)
+    if merchant_ids is not None:
+        shards = shards.filter(merchant_id__in=merchant_ids)
+
+    with transaction.atomic():
+        locked = list(
+            Merchant.objects.filter(id__in=shards.values("merchant_id")).order_by("id")
+            .select_for_update().values_list("id", flat=True)
+        )
+        rows = list(
+            shards.filter(merchant_id__in=locked).order_by("id")
+            .select_for_update().values_list("id", "merchant_id", "balance")
+        )
+        if not rows:
+            return 0
+
+        totals = {}
+        for _, merchant_id, balance in rows:
+            totals[merchant_id] = totals.get(merchant_id, 0) + balance
+
+        MerchantBalanceShard.objects.filter(id__in=[shard_id for shard_id, _, _ in rows]).update(balance=F("balance") - Case(
+            *[When(id=shard_id, then=Value(balance)) for shard_id, _, balance in rows],
+            output_field=models.IntegerField(),
+        ))
+        Merchant.objects.filter(id__in=totals).update(balance=F("balance") + Case(
+            *[When(id=merchant_id, then=Value(total)) for merchant_id, total in totals.items()],
+            output_field=models.IntegerField(),
+        ))
+    return len(totals)
+
+def set_balance_shards(merchant_id, shards):
+    """
+    Switch a merchant to ``shards`` balance shards, or back to a single
+    balance row with 0. Pending shard credits are compacted first.
+    """
+    with transaction.atomic():
+        merchant = Merchant.objects.select_for_update().get(id=merchant_id)
+        compact_balance_shards([merchant_id])
+        MerchantBalanceShard.objects.filter(merchant_id=merchant_id).delete()
+        MerchantBalanceShard.objects.bulk_create([
+            MerchantBalanceShard(merchant_id=merchant_id, shard=shard)
+            for shard in range(shards)
+        ])
+        merchant.balance_shards = shards
+        merchant.save(update_fields=["balance_shards"])
+
+def transfer(customer_id, merchant_id, price):
+    """
+    Move ``price`` from a customer to a merchant in a single transaction.
+
+    The merchant is credited first so an unknown merchant is reported before
+    the balance check, then the customer is debited. Both rows are always
+    locked in that order, which keeps concurrent transfers free of deadlocks.
+
+    With ASYNC_SETTLEMENT on, the merchant isn't credited here. A
+    PendingCredit is written instead and applied later by the settlement
+    worker, so the request only writes the customer row.
+
+    Every successful transfer is recorded in the Transaction ledger.
+    Raises Merchant.DoesNotExist or InsufficientBalance, in which case
+    nothing is written. Returns the customer's remaining balance.
+    """
+    settle_later = getattr(settings, "ASYNC_SETTLEMENT", False)
+    with transaction.atomic():
+        if settle_later:
+            if not Merchant.objects.filter(id=merchant_id).exists():
+                raise Merchant.DoesNotExist
+        elif not credit_merchant(merchant_id, price):
+            raise Merchant.DoesNotExist
+
+        balance = _debit(customer_id, price)
+        if balance is None:
+            raise InsufficientBalance
+
+        if settle_later:
+            PendingCredit.objects.create(merchant_id=merchant_id, amount=price)
+        else:
+            invalidate_detail(Merchant, merchant_id)
+
+        Transaction.objects.create(
+            customer_id=customer_id,
+            merchant_id=merchant_id,
+            amount=price,
+        )
+        stats.record(merchant_balance=price, customer_balance=-price)
+        invalidate_detail(Customer, customer_id)
+    return balance
+
+def _plan_bulk(balance, items, merchants):
+    """
+    Walk the items in order against a running balance. Returns the per item
+    results, the accepted items and the total credit owed to each merchant.
+    """
+    results, accepted, credits = [], [], {}
+    for merchant_id, price in items:
+        if merchant_id not in merchants:
+            results.append({"merchant_id": merchant_id, "price": price, "status": 404, "detail": "Merchant Not Found"})
+        elif price > balance:
+            results.append({"merchant_id": merchant_id, "price": price, "status": 402, "detail": "Insufficient Balance"})
+        else:
+            balance -= price
+            accepted.append((merchant_id, price))
+            credits[merchant_id] = credits.get(merchant_id, 0) + price
+            results.append({"merchant_id": merchant_id, "price": price, "status": 200, "detail": "Transaction Successfull"})
+    return results, accepted, credits
+
+def bulk_transfer(customer_id, items, attempts=3):
+    """
+    Apply a batch of (merchant_id, price) purchases for one customer.
+
+    Merchants are loaded with one in_bulk query and the credits are grouped
+    per merchant into a single CASE update, sharded merchants are credited
+    through their shards instead. The customer is debited once for
+    the accepted total with the same conditional UPDATE as transfer(), all in
+    one transaction. If the balance changed concurrently between planning and
+    the debit, the batch is re-planned, up to ``attempts`` times before
+    BalanceChanged is raised.
+
+    Returns the customer's remaining balance and a result for every item.
+    """
+    merchants = Merchant.objects.only("id", "balance_shards").in_bulk({merchant_id for merchant_id, _ in items})
+    for attempt in range(attempts):
+        balance = Customer.objects.values_list("balance", flat=True).get(id=customer_id)
+        results, accepted, credits = _plan_bulk(balance, items, merchants)
+        if not accepted:
+            return balance, results
+        try:
+            with transaction.atomic():
+                plain = {
+                    merchant_id: amount for merchant_id, amount in credits.items()
+                    if not merchants[merchant_id].balance_shards
+                }
+                credited = Merchant.objects.filter(id__in=plain, balance_shards=0).update(balance=F("balance") + Case(
+                    *[When(id=merchant_id, then=Value(amount)) for merchant_id, amount in plain.items()],
+                    output_field=models.IntegerField(),
+                )) if plain else 0
+                for merchant_id, amount in credits.items():
+                    if merchant_id not in plain and credit_merchant(merchant_id, amount):
+                        credited += 1
+                if credited != len(credits):
+                    # A merchant was deleted or sharded since in_bulk, re-plan.
+                    merchants = Merchant.objects.only("id", "balance_shards").in_bulk(list(merchants))
+                    raise BalanceChanged
+
+                balance = _debit(customer_id, sum(price for _, price in accepted))
+                if balance is None:
+                    raise BalanceChanged
+
+                Transaction.objects.bulk_create([
+                    Transaction(customer_id=customer_id, merchant_id=merchant_id, amount=price)
+                    for merchant_id, price in accepted
+                ])
+                total = sum(credits.values())
+                stats.record(merchant_balance=total, customer_balance=-total)
+                invalidate_detail(Merchant, *credits)
+                invalidate_detail(Customer, customer_id)
+        except BalanceChanged:
+            continue
+        return balance, results
+    raise BalanceChanged
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from core.cache import invalidate_detail
+from core.models import Merchant, PendingCredit
+from core.services import credit_merchants
+
+class AlreadySettled(Exception):
+    """
+    Some credits of a batch were settled by another worker in the meantime,
+    the batch was rolled back and can simply be claimed again.
+    """
+
+def settle_batch(batch_size=None):
+    """
+    Apply up to ``batch_size`` pending credits, oldest first, summed per
+    merchant. Returns the number of credits settled.
+
+    The credits are applied and their PendingCredit rows deleted in one
+    transaction, and the batch is rolled back with AlreadySettled unless
+    every row it read was still there to delete, so each credit is applied
+    exactly once. Where the database supports it the rows are claimed with
+    SKIP LOCKED, so concurrent workers take disjoint batches.
+    """
+    batch_size = batch_size or getattr(settings, "SETTLEMENT_BATCH_SIZE", 500)
+    with transaction.atomic():
+        pending = PendingCredit.objects.order_by("id")
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        rows = list(pending.values_list("id", "merchant_id", "amount")[:batch_size])
+        if not rows:
+            return 0
+
+        credits = {}
+        for _, merchant_id, amount in rows:
+            credits[merchant_id] = credits.get(merchant_id, 0) + amount
+
+        deleted, _ = PendingCredit.objects.filter(id__in=[credit_id for credit_id, _, _ in rows]).delete()
+        if deleted != len(rows):
+            raise AlreadySettled
+        # A merchant's pending credits are deleted along with it, so every
+        # merchant in the batch still exists.
+        credit_merchants(credits)
+        invalidate_detail(Merchant, *credits)
+    return len(rows)
+
+def backlog():
+    """
+    Return the number of pending credits, their total and the age in
+    seconds of the oldest one, which is how far settlement lags behind.
+    """
+    summary = PendingCredit.objects.aggregate(
+        count=models.Count("id"), amount=models.Sum("amount"), oldest=models.Min("created"))
+    lag = (timezone.now() - summary["oldest"]).total_seconds() if summary["oldest"] else 0.0
+    return {"count": summary["count"], "amount": summary["amount"] or 0, "lag_seconds": round(lag, 3)}
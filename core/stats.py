@@ -0,0 +1,89 @@
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from core.models import Customer, Merchant, MerchantBalanceShard, PendingCredit, StatCounter
+
+COUNTERS = ("merchant_count", "customer_count", "merchant_balance", "customer_balance")
+
+def _shards():
+    return getattr(settings, "STATS_SHARDS", 8)
+
+def record(**deltas):
+    """
+    Add deltas to the named counters, e.g. ``record(merchant_count=1)``.
+
+    Call it inside the transaction that makes the change, so the counters
+    commit or roll back with it. All deltas go to one randomly picked shard
+    in a single CASE update, so concurrent writers rarely wait on each other.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    shard = random.randrange(_shards())
+    counters = StatCounter.objects.filter(name__in=deltas, shard=shard)
+    updated = counters.update(value=F("value") + Case(
+        *[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+        output_field=models.BigIntegerField(),
+    ))
+    if updated == len(deltas):
+        return
+
+    # First write to this shard, create its missing rows.
+    existing = set(counters.values_list("name", flat=True))
+    for name, delta in deltas.items():
+        if name in existing:
+            continue
+        try:
+            with transaction.atomic():
+                StatCounter.objects.create(name=name, shard=shard, value=delta)
+        except IntegrityError:
+            StatCounter.objects.filter(name=name, shard=shard).update(value=F("value") + delta)
+
+def read():
+    """
+    Return every counter's total. Costs one query over at most
+    ``len(COUNTERS) * STATS_SHARDS`` rows, whatever the number of accounts.
+    """
+    totals = dict.fromkeys(COUNTERS, 0)
+    totals.update(StatCounter.objects.values_list("name").annotate(total=Sum("value")).order_by())
+    return totals
+
+def compute():
+    """
+    Compute the counters from the merchant and customer tables. Credits
+    waiting for settlement already count towards the merchant balance.
+    """
+    merchants = Merchant.objects.aggregate(count=models.Count("id"), balance=Sum("balance"))
+    customers = Customer.objects.aggregate(count=models.Count("id"), balance=Sum("balance"))
+    shard_balance = MerchantBalanceShard.objects.aggregate(balance=Sum("balance"))["balance"]
+    pending = PendingCredit.objects.aggregate(amount=Sum("amount"))["amount"]
+    return {
+        "merchant_count": merchants["count"],
+        "customer_count": customers["count"],
+        "merchant_balance": (merchants["balance"] or 0) + (shard_balance or 0) + (pending or 0),
+        "customer_balance": customers["balance"] or 0,
+    }
+
+def rebuild():
+    """
+    Recompute the counters from scratch and store them in shard 0, the
+    other shards' rows are created at 0 so no later record() pays for it.
+
+    The counter rows are locked before the tables are summed, so a
+    concurrent change either committed before and is counted, or waits for
+    the rebuild and then applies its delta on top. Returns the new totals.
+    """
+    StatCounter.objects.bulk_create(
+        [StatCounter(name=name, shard=shard) for name in COUNTERS for shard in range(_shards())],
+        ignore_conflicts=True,
+    )
+    with transaction.atomic():
+        list(StatCounter.objects.select_for_update().values_list("id"))
+        totals = compute()
+        StatCounter.objects.exclude(shard=0).update(value=0)
+        for name, value in totals.items():
+            StatCounter.objects.update_or_create(name=name, shard=0, defaults={"value": value})
+    return totals
@@ -0,0 +1,42 @@
+from rest_framework.response import Response
+from rest_framework import serializers
+from rest_framework import views
+
+from core.models import Merchant
+from core.permissions import IsStaffOrReadOnly
+from core.serializers import MerchantSerializer
+from core import stats
+
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from django.conf import settings
+
+class Stats(views.APIView):
+    permission_classes = [IsStaffOrReadOnly,]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter("top", openapi.IN_QUERY, "Number of top merchants to return, defaults to STATS_TOP_MERCHANTS.", type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: "Account Counts, Total Balances And The Top Merchants By Balance",
+            400: "Bad Request",
+        }
+    )
+    def get(self, request):
+        """
+        Statistics
+
+        Return the number of merchants and customers, their total balances and the top merchants by balance.
+        Totals are read from counters kept up to date by every write, so this doesn't scan the accounts.
+        Top merchants are ranked by their balance without pending shard credits.
+        Return 400 if top isn't between 0 and STATS_MAX_TOP_MERCHANTS.
+        """
+        top = serializers.IntegerField(min_value=0, max_value=getattr(settings, "STATS_MAX_TOP_MERCHANTS", 100)).run_validation(
+            request.query_params.get("top", getattr(settings, "STATS_TOP_MERCHANTS", 10)))
+
+        merchants = Merchant.objects.select_related("user").with_shard_balance().order_by("-balance", "-id")[:top]
+        return Response({
+            **stats.read(),
+            "top_merchants": MerchantSerializer(merchants, many=True).data,
+        })
@@ -0,0 +1,751 @@
+import json
+import random
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import QuerySet, Sum
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+from core import benchmark, db, idempotency, metrics, schema, services, settlement, stats
+from core.authentication import KEYWORD, issue_key, revoke_keys
+from core.db import database_sync_to_async
+from core.filters import filter_profiles
+from core.models import ApiKey, Customer, IdempotencyKey, Merchant, MerchantBalanceShard, PendingCredit, StatCounter, Transaction, User
+
+def create_merchants(count, prefix="merchant"):
+    return [services.create_account(f"{prefix}-{number}", "password", is_merchant=True) for number in range(count)]
+
+def create_customers(count, prefix="customer"):
+    return [services.create_account(f"{prefix}-{number}", "password", is_customer=True) for number in range(count)]
+
+def create_stat_counters():
+    """
+    Create every counter shard's row, as in a database that's been running
+    for a while, so stats.record() is a single UPDATE.
+    """
+    for name in stats.COUNTERS:
+        for shard in range(settings.STATS_SHARDS):
+            StatCounter.objects.get_or_create(name=name, shard=shard)
+
+class CacheClearingTestCase(TestCase):
+    def setUp(self):
+        caches[getattr(settings, "DETAIL_CACHE_ALIAS", "default")].clear()
+
+class ListQueryCountTest(CacheClearingTestCase):
+    """
+    The list endpoints serialize nested users from one joined query,
+    however many rows there are.
+    """
+    def assertListQueries(self, url, create):
+        total = 0
+        for count in (1, 24):
+            create(count, prefix=f"batch-{total}")
+            total += count
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), total)
+
+    def test_merchant_list(self):
+        self.assertListQueries("/api/merchants/", create_merchants)
+
+    def test_customer_list(self):
+        self.assertListQueries("/api/customers/", create_customers)
+
+class ConcurrentTransferTest(TransactionTestCase):
+    """
+    Thousands of transfers from several threads against the file backed
+    test database. Money is only ever moved, and no balance goes negative.
+    """
+    threads = 8
+    transfers_per_thread = 250
+
+    def test_balances_are_conserved(self):
+        merchant_ids = [user.merchant.id for user in create_merchants(5)]
+        customer_ids = [user.customer.id for user in create_customers(20)]
+        Customer.objects.update(balance=2000)
+        total = self.total_balance()
+        failures = []
+
+        def work(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.transfers_per_thread):
+                    try:
+                        services.transfer(rng.choice(customer_ids), rng.choice(merchant_ids), rng.randint(1, 50))
+                    except services.InsufficientBalance:
+                        pass
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work, args=(seed,)) for seed in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(self.total_balance(), total)
+        self.assertFalse(Customer.objects.filter(balance__lt=0).exists())
+        self.assertEqual(
+            Transaction.objects.aggregate(total=Sum("amount"))["total"],
+            Merchant.objects.aggregate(total=Sum("balance"))["total"],
+        )
+
+    def total_balance(self):
+        merchants = Merchant.objects.aggregate(total=Sum("balance"))["total"] or 0
+        customers = Customer.objects.aggregate(total=Sum("balance"))["total"] or 0
+        return merchants + customers
+
+class IdempotencyKeyTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        idempotency.cache.clear()
+        self.merchant = create_merchants(1)[0].merchant
+        self.user = create_customers(1)[0]
+        Customer.objects.update(balance=100)
+        self.client.force_login(self.user)
+
+    def buy(self):
+        return self.client.post(f"/api/transaction/{self.merchant.id}/10/", HTTP_IDEMPOTENCY_KEY="order-1")
+
+    def test_retry_replays_the_first_response(self):
+        first = self.buy()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.buy().json(), first.json())
+        self.assertEqual(Customer.objects.get().balance, 90)
+
+    def test_expired_key_can_be_reused_before_it_is_purged(self):
+        self.buy()
+        IdempotencyKey.objects.update(created=timezone.now() - idempotency.get_ttl() - timedelta(seconds=1))
+        idempotency.cache.clear()
+        self.assertEqual(self.buy().status_code, 200)
+        self.assertEqual(Customer.objects.get().balance, 80)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+# Hashing hundreds of passwords for real would dominate the run.
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ProfileAdminQueryCountTest(CacheClearingTestCase):
+    """
+    A changelist page costs the session, the user, the count and the page,
+    however many profiles there are, with or without search and filters.
+    """
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(services.create_account("admin", "password", is_superuser=True))
+
+    def assertChangelistQueries(self, url, create):
+        total = 0
+        for count in (5, 150):
+            create(count - total, prefix=f"batch-{total}")
+            total = count
+            for params in ({}, {"q": "batch-"}, {"balance_range": "0"}):
+                with self.assertNumQueries(4):
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context["cl"].result_count, total)
+
+    def test_merchant_changelist(self):
+        self.assertChangelistQueries("/admin/core/merchant/", create_merchants)
+
+    def test_customer_changelist(self):
+        self.assertChangelistQueries("/admin/core/customer/", create_customers)
+
+class PurchaseBoundsTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.merchant = create_merchants(1)[0].merchant
+        self.client.force_login(create_customers(1)[0])
+
+    def test_values_above_the_integer_range_are_rejected(self):
+        for data in ({"merchant_id": self.merchant.id, "amount": 10 ** 20}, {"merchant_id": 10 ** 20, "amount": 1}):
+            response = self.client.post("/api/transactions/", data, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        for merchant_id, price in ((self.merchant.id, 10 ** 20), (10 ** 20, 1)):
+            self.assertEqual(self.client.post(f"/api/transaction/{merchant_id}/{price}/").status_code, 400)
+            response = self.client.post(
+                "/api/transactions/bulk/", [{"merchant_id": merchant_id, "price": price}], content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_bulk_rejects_zero_prices(self):
+        response = self.client.post(
+            "/api/transactions/bulk/", [{"merchant_id": self.merchant.id, "price": 0}], content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+    @override_settings(BULK_TRANSACTION_MAX_ITEMS=2)
+    def test_bulk_size_is_checked_before_the_items(self):
+        items = [{"merchant_id": "invalid"}] * 3
+        response = self.client.post("/api/transactions/bulk/", items, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"detail": "A Bulk Transaction Can Have At Most 2 Items"})
+
+@override_settings(ACCOUNT_IMPORT_WORKERS=0)
+class AccountBulkCreateTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(services.create_account("admin", "password", is_superuser=True))
+
+    def test_bad_lines_are_reported_per_row(self):
+        body = "\n".join([
+            '{"username": "first", "password": "secret", "role": "merchant"}',
+            '{"username": "broken", ',
+            "[1]",
+            '{"username": "second", "password": "secret", "role": "customer", "balance": 5}',
+        ])
+        response = self.client.post("/api/accounts/bulk/", body, content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, 201)
+        summary = response.json()
+        self.assertEqual(summary["created"], 2)
+        self.assertEqual([error["row"] for error in summary["errors"]], [2, 3])
+        self.assertEqual(Customer.objects.get().balance, 5)
+        self.assertTrue(Merchant.objects.filter(user__username="first").exists())
+
+    def test_out_of_range_balances_and_non_string_passwords_are_reported_per_row(self):
+        body = "\n".join([
+            '{"username": "huge", "password": "secret", "role": "customer", "balance": 100000000000000000000}',
+            '{"username": "big", "password": "secret", "role": "customer", "balance": 3000000000}',
+            '{"username": "numeric", "password": 123, "role": "customer"}',
+            '{"username": 7, "password": "secret", "role": "customer"}',
+            '{"username": "largest", "password": "secret", "role": "customer", "balance": 2147483647}',
+        ])
+        response = self.client.post("/api/accounts/bulk/", body, content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, 201)
+        summary = response.json()
+        self.assertEqual(summary["created"], 1)
+        self.assertEqual([error["row"] for error in summary["errors"]], [1, 2, 3, 4])
+        self.assertEqual(Customer.objects.get().balance, 2147483647)
+
+TRANSACTION_CONTROL = ("BEGIN", "SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+class CreateAccountQueryCountTest(CacheClearingTestCase):
+    """
+    Creating an account costs three statements besides transaction control:
+    the user and profile inserts and the /api/stats/ counter update, once
+    every counter shard has its rows.
+    """
+    def setUp(self):
+        super().setUp()
+        create_stat_counters()
+
+    def assertStatements(self, expected, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            user = services.create_account("someone", "password", **kwargs)
+        statements = [query["sql"] for query in queries if not query["sql"].startswith(TRANSACTION_CONTROL)]
+        self.assertEqual(len(statements), expected, "\n".join(statements))
+        return user
+
+    def test_create_merchant(self):
+        user = self.assertStatements(3, is_merchant=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.merchant.user.username, "someone")
+
+    def test_create_customer(self):
+        user = self.assertStatements(3, is_customer=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.customer.user.username, "someone")
+
+class ProfileLookupQueryCountTest(CacheClearingTestCase):
+    """
+    The caller's profile ids come from the session or the API key principal,
+    the profile tables are only read for the data the view returns.
+    """
+    def setUp(self):
+        super().setUp()
+        create_stat_counters()
+        self.merchant = create_merchants(1)[0].merchant
+        self.customer = create_customers(1)[0].customer
+        Customer.objects.update(balance=100)
+        self.urls = [f"/api/merchants/{self.merchant.id}/", f"/api/customers/{self.customer.id}/"]
+
+    def assertNoProfileLookup(self, expected, method, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        statements = [query["sql"] for query in queries if not query["sql"].startswith(TRANSACTION_CONTROL)]
+        self.assertEqual(len(statements), expected, "\n".join(statements))
+        for sql in statements:
+            if sql.startswith("SELECT"):
+                self.assertNotIn("core_merchant", sql)
+                self.assertNotIn("core_customer", sql)
+                self.assertNotIn("JOIN", sql)
+
+    def check(self, user, session_queries, **headers):
+        for url in self.urls:
+            self.client.get(url, **headers)
+        for url in self.urls:
+            self.assertNoProfileLookup(session_queries, "get", url, **headers)
+        if user.is_customer:
+            # The two balance updates, the transaction and the stat counters.
+            self.assertNoProfileLookup(session_queries + 4, "post", f"/api/transaction/{self.merchant.id}/1/", **headers)
+
+    def test_session(self):
+        for user in (self.merchant.user, self.customer.user):
+            self.client.force_login(user)
+            # The session and the user, loaded without the profile join.
+            self.check(user, 2)
+
+    def test_api_key(self):
+        for user in (self.merchant.user, self.customer.user):
+            self.check(user, 0, HTTP_AUTHORIZATION=f"{KEYWORD} {issue_key(user)[1]}")
+
+class OwnershipQueryCountTest(CacheClearingTestCase):
+    """
+    Ownership is checked against ids already loaded, the requesting user's
+    profile is never fetched.
+    """
+    def setUp(self):
+        super().setUp()
+        create_stat_counters()
+        self.merchant = create_merchants(1)[0].merchant
+        self.owner, self.other = create_customers(2)
+        self.headers = {"HTTP_AUTHORIZATION": f"{KEYWORD} {issue_key(self.owner)[1]}"}
+        self.client.get("/api/stats/", **self.headers)
+
+    def test_update(self):
+        with self.assertNumQueries(6):
+            response = self.client.put(
+                f"/api/customers/{self.owner.customer.id}/", {"balance": 50},
+                content_type="application/json", **self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(1):
+            response = self.client.put(
+                f"/api/customers/{self.other.customer.id}/", {"balance": 50},
+                content_type="application/json", **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_delete(self):
+        with self.assertNumQueries(1):
+            response = self.client.delete(f"/api/customers/{self.other.customer.id}/", **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+        with self.assertNumQueries(14):
+            response = self.client.delete(f"/api/customers/{self.owner.customer.id}/", **self.headers)
+        self.assertEqual(response.status_code, 204)
+
+    def test_transaction_lists(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/customers/{self.owner.customer.id}/transactions/", **self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/api/customers/{self.other.customer.id}/transactions/", **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/api/merchants/{self.merchant.id}/transactions/", **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+@mock.patch("core.db.replicas", return_value=["replica1"])
+class PrimaryReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = db.PrimaryReplicaRouter()
+        token = db._use_replica.set(True)
+        self.addCleanup(db._use_replica.reset, token)
+
+    def test_profiles_are_read_from_replicas(self, replicas):
+        # TestCase runs inside a transaction, as if outside one here.
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            self.assertEqual(self.router.db_for_read(Merchant), "replica1")
+            with db.use_primary():
+                self.assertEqual(self.router.db_for_read(Merchant), "default")
+
+    def test_sessions_users_and_api_keys_are_read_from_the_primary(self, replicas):
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            for model in (Session, User, ApiKey):
+                self.assertEqual(self.router.db_for_read(model), "default")
+
+class ConnectionHealthCheckTest(TestCase):
+    def test_connections_are_checked_on_first_use_in_a_request(self):
+        conn = connections["default"]
+        conn.ensure_connection()
+        with mock.patch.dict(conn.settings_dict, {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True}), \
+                mock.patch.object(conn, "in_atomic_block", False), \
+                mock.patch.object(conn, "is_usable", return_value=True) as is_usable:
+            for _ in range(2):
+                db.check_persistent_connections(sender=None)
+                is_usable.assert_not_called()
+                conn.ensure_connection()
+                conn.ensure_connection()
+                is_usable.assert_called_once()
+                is_usable.reset_mock()
+
+class AsyncViewTest(TransactionTestCase):
+    """
+    The async views run their database work on executor threads, with their
+    own connections, so the data has to be committed: TransactionTestCase.
+    """
+    def setUp(self):
+        caches[getattr(settings, "DETAIL_CACHE_ALIAS", "default")].clear()
+        metrics.request_queries.clear()
+        self.merchant = create_merchants(3)[0].merchant
+        self.customer = create_customers(1)[0]
+        self.token = f"{KEYWORD} {issue_key(self.customer)[1]}"
+
+    def test_middleware_is_async_capable(self):
+        for path in settings.MIDDLEWARE:
+            middleware = import_string(path)
+            self.assertTrue(getattr(middleware, "async_capable", False), path)
+
+    async def test_list_and_detail(self):
+        client = AsyncClient()
+        response = await client.get("/api/async/merchants/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+        response = await client.get(f"/api/async/merchants/{self.merchant.id}/", authorization=self.token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], self.merchant.id)
+
+        # Queries made on the executor threads are still counted.
+        self.assertIn("http_request_db_queries_count{method=\"GET\",route=\"/api/async/merchants/\"} 1", metrics.request_queries.collect())
+
+    async def test_session_user(self):
+        client = AsyncClient()
+        await database_sync_to_async(client.force_login)(self.customer)
+        response = await client.get(f"/api/async/customers/{self.customer.customer.id}/")
+        self.assertEqual(response.status_code, 200)
+
+    async def test_errors_have_the_sync_views_status(self):
+        client = AsyncClient()
+        # AsyncClient.get() drops its data argument on Django 3.2, the query
+        # strings are in the paths.
+        requests = [
+            ("merchants/?cursor=garbage", {}),
+            ("merchants/?min_balance=x", {}),
+            (f"merchants/{self.merchant.id}/", {"authorization": f"{KEYWORD} wrong"}),
+        ]
+        for path, headers in requests:
+            expected = await database_sync_to_async(self.client.get)(
+                f"/api/{path}", **{f"HTTP_{name.upper()}": value for name, value in headers.items()})
+            response = await client.get(f"/api/async/{path}", **headers)
+            self.assertIn(expected.status_code, (400, 403, 404))
+            self.assertEqual(response.status_code, expected.status_code, path)
+
+class ListFilterTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        create_merchants(3, prefix="alice")
+        create_merchants(2, prefix="bob")
+
+    def test_search(self):
+        response = self.client.get("/api/merchants/", {"search": "ali"})
+        self.assertEqual([merchant["user"]["username"] for merchant in response.json()], ["alice-0", "alice-1", "alice-2"])
+        self.assertEqual(self.client.get("/api/merchants/", {"search": chr(sys.maxunicode)}).status_code, 204)
+        self.assertEqual(self.client.get("/api/merchants/", {"search": "b" + chr(0xD7FF)}).status_code, 204)
+
+    def test_invalid_parameters(self):
+        for params in ({"min_balance": "x"}, {"max_balance": str(10 ** 20)}, {"min_balance": str(-10 ** 20)},
+                       {"ordering": "username"}, {"search": "a\x00"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/api/merchants/", params).status_code, 400)
+
+    def plan(self, params):
+        queryset, _ = filter_profiles(Merchant.objects.select_related("user"), params)
+        return queryset[:100].explain().lower()
+
+    def test_search_uses_the_username_index(self):
+        plan = self.plan({"search": "ali"})
+        self.assertIn("index", plan)
+        self.assertNotIn("scan core_user", plan)
+
+    def test_balance_filters_and_ordering_use_the_balance_index(self):
+        for params in ({"min_balance": "5", "max_balance": "10"}, {"ordering": "-balance"}):
+            with self.subTest(params=params):
+                self.assertIn("core_merchant_balance", self.plan(params))
+
+    def test_sparse_fieldsets_only_join_users_for_usernames(self):
+        Merchant.objects.filter(user__username="alice-1").update(balance=7)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/merchants/", {"fields": "id,balance"})
+        self.assertEqual(response.json()[1], {"id": 2, "balance": 7})
+        self.assertNotIn("core_user", queries[0]["sql"])
+
+        response = self.client.get("/api/merchants/", {"fields": "username", "ordering": "-balance", "page_size": 2})
+        page = response.json()
+        self.assertEqual(page["results"], [{"username": "alice-1"}, {"username": "bob-1"}])
+        self.assertEqual(self.client.get(page["next"]).json()["results"], [{"username": "bob-0"}, {"username": "alice-2"}])
+
+class UserDeleteTest(CacheClearingTestCase):
+    """
+    However users are deleted, the stats counters stay in step.
+    """
+    def setUp(self):
+        super().setUp()
+        self.merchants = create_merchants(2)
+        self.customers = create_customers(2)
+        Customer.objects.update(balance=100)
+        stats.rebuild()
+        self.client.force_login(services.create_account("admin", "password", is_superuser=True))
+
+    def test_queryset_and_instance_delete(self):
+        User.objects.filter(id=self.customers[0].id).delete()
+        User.objects.get(id=self.merchants[0].id).delete()
+        self.assertEqual(stats.read(), stats.compute())
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_admin_delete(self):
+        self.client.post(f"/admin/core/user/{self.merchants[0].id}/delete/", {"post": "yes"})
+        self.client.post("/admin/core/user/", {
+            "action": "delete_selected", "post": "yes", "_selected_action": [user.id for user in self.customers],
+        })
+        self.assertEqual(Merchant.objects.count(), 1)
+        self.assertEqual(Customer.objects.count(), 0)
+        self.assertEqual(stats.read(), stats.compute())
+
+    def test_ledger_keeps_deleted_accounts_without_reading_it(self):
+        customer, merchant = self.customers[0].customer, self.merchants[0].merchant
+        services.transfer(customer.id, merchant.id, 10)
+        with CaptureQueriesContext(connection) as queries:
+            services.delete_users([self.customers[0].id, self.merchants[0].id])
+        self.assertFalse([query["sql"] for query in queries if "core_transaction" in query["sql"]])
+        self.assertEqual(Transaction.objects.values_list("customer_id", "merchant_id").get(), (customer.id, merchant.id))
+
+class SchemaViewTest(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(SCHEMA_CACHE_DIR=cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema._documents.clear()
+        self.addCleanup(schema._documents.clear)
+
+    def test_schema_is_generated_at_most_once(self):
+        with mock.patch.object(OpenAPISchemaGenerator, "get_schema", autospec=True,
+                               side_effect=OpenAPISchemaGenerator.get_schema) as get_schema:
+            for _ in range(3):
+                response = self.client.get("/docs/")
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, schema.INFO.title)
+                response = self.client.get("/docs/", {"format": "openapi"})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("/merchants/", response.json()["paths"])
+        self.assertLessEqual(get_schema.call_count, 1)
+
+class BenchmarkTest(TestCase):
+    def test_seed_creates_every_counter_shard(self):
+        benchmark.seed(3, 2, balance=100)
+        self.assertEqual(StatCounter.objects.count(), len(stats.COUNTERS) * settings.STATS_SHARDS)
+        self.assertEqual(stats.read(), stats.compute())
+        with self.assertNumQueries(1):
+            stats.record(merchant_balance=1)
+
+    def test_query_slack_is_relative(self):
+        def results(queries):
+            return [{"scenario": "transaction", "concurrency": 1, "rps": 100, "p99_ms": 10, "queries_per_request": queries, "errors": 0}]
+
+        self.assertEqual(benchmark.compare(results(20.5), {"results": results(20)}, 0.25), [])
+        self.assertEqual(len(benchmark.compare(results(22), {"results": results(20)}, 0.25)), 1)
+
+class BalanceShardBenchmarkTest(TransactionTestCase):
+    def test_stats_stay_in_step(self):
+        stats.rebuild()
+        call_command("benchmark_balance_shards", shards=[0, 2], threads=2, credits=5, stdout=StringIO())
+        self.assertFalse(Merchant.objects.exists())
+        self.assertEqual(stats.read(), stats.compute())
+
+@override_settings(ASYNC_SETTLEMENT=True)
+class SettlementTest(TransactionTestCase):
+    """
+    Purchases queue PendingCredit rows, which the settlement workers apply
+    exactly once, concurrently.
+    """
+    def setUp(self):
+        self.merchant_ids = [user.merchant.id for user in create_merchants(3)]
+        services.set_balance_shards(self.merchant_ids[0], 4)
+        self.customer_ids = [user.customer.id for user in create_customers(5)]
+        Customer.objects.update(balance=1000)
+        stats.rebuild()
+        rng = random.Random(0)
+        for _ in range(200):
+            services.transfer(rng.choice(self.customer_ids), rng.choice(self.merchant_ids), rng.randint(1, 10))
+
+    def assertSettled(self):
+        self.assertFalse(PendingCredit.objects.exists())
+        for merchant in Merchant.objects.with_shard_balance():
+            ledger = Transaction.objects.filter(merchant_id=merchant.id).aggregate(total=Sum("amount"))["total"]
+            self.assertEqual(merchant.balance + merchant.shard_balance, ledger)
+        self.assertEqual(stats.read(), stats.compute())
+
+    def test_concurrent_workers_settle_every_credit_once(self):
+        self.assertEqual(PendingCredit.objects.count(), 200)
+        call_command("run_settlement", workers=2, batch_size=7, once=True, stdout=StringIO())
+        self.assertSettled()
+
+    def test_batch_is_rolled_back_if_another_worker_settled_a_credit(self):
+        delete = QuerySet.delete
+        first_id = PendingCredit.objects.order_by("id").values_list("id", flat=True).first()
+
+        def racing_delete(queryset):
+            # Another worker settles the oldest credit between the read and the delete.
+            delete(PendingCredit.objects.filter(id=first_id))
+            return delete(queryset)
+
+        balances = dict(Merchant.objects.values_list("id", "balance"))
+        with mock.patch.object(QuerySet, "delete", racing_delete):
+            with self.assertRaises(settlement.AlreadySettled):
+                settlement.settle_batch(50)
+        self.assertEqual(PendingCredit.objects.count(), 200)
+        self.assertEqual(dict(Merchant.objects.values_list("id", "balance")), balances)
+
+        while settlement.settle_batch(50):
+            pass
+        self.assertSettled()
+
+class BalanceShardTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.merchant_id = create_merchants(1)[0].merchant.id
+        Merchant.objects.update(balance=100)
+
+    def total(self):
+        merchant = Merchant.objects.with_shard_balance().get()
+        return merchant.balance + merchant.shard_balance
+
+    def test_total_is_conserved_across_sharding_and_compaction(self):
+        services.set_balance_shards(self.merchant_id, 4)
+        for _ in range(20):
+            self.assertTrue(services.credit_merchant(self.merchant_id, 3))
+        self.assertEqual(services.credit_merchants({self.merchant_id: 5}), 1)
+        self.assertEqual(Merchant.objects.get().balance, 100)
+        self.assertEqual(self.total(), 165)
+
+        self.assertEqual(services.compact_balance_shards(), 1)
+        self.assertEqual(Merchant.objects.get().balance, 165)
+        self.assertEqual(self.total(), 165)
+
+        services.credit_merchant(self.merchant_id, 10)
+        services.set_balance_shards(self.merchant_id, 0)
+        self.assertFalse(MerchantBalanceShard.objects.exists())
+        self.assertEqual(Merchant.objects.get().balance, 175)
+        services.credit_merchant(self.merchant_id, 1)
+        self.assertEqual(self.total(), 176)
+
+    def test_compaction_locks_merchants_before_shards(self):
+        services.set_balance_shards(self.merchant_id, 2)
+        services.credit_merchant(self.merchant_id, 3)
+        with CaptureQueriesContext(connection) as queries:
+            services.compact_balance_shards([self.merchant_id])
+        selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+        self.assertTrue(selects[0].startswith('SELECT "core_merchant"."id" FROM "core_merchant"'), selects[0])
+        self.assertIn('FROM "core_merchantbalanceshard"', selects[1])
+
+class ApiKeyTest(TestCase):
+    def test_prefixes_are_unique_and_revoke_one_key(self):
+        first, second = create_customers(2)
+        with mock.patch("core.authentication.secrets.token_hex", side_effect=["aaaa0000", "aaaa0000", "bbbb1111"]):
+            issue_key(first)
+            api_key, key = issue_key(second)
+        self.assertEqual(api_key.prefix, "bbbb1111")
+        self.assertTrue(key.startswith("bbbb1111."))
+
+        self.assertEqual(revoke_keys("aaaa0000"), 1)
+        self.assertEqual(list(ApiKey.objects.values_list("user_id", flat=True)), [second.id])
+
+class DetailCacheTest(CacheClearingTestCase):
+    """
+    Detail responses are served from the cache with an ETag, and dropped
+    from it once a write to the object commits.
+    """
+    def setUp(self):
+        super().setUp()
+        self.merchant = create_merchants(1)[0].merchant
+        self.user = create_customers(1)[0]
+        self.customer = self.user.customer
+        Customer.objects.update(balance=100)
+        self.client.force_login(self.user)
+        self.url = f"/api/customers/{self.customer.id}/"
+
+    def get(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_matching_etag_gets_a_304(self):
+        etag = self.get()["ETag"]
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_put_invalidates(self):
+        etag = self.get()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(self.url, {"balance": 50}, content_type="application/json")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["balance"], 50)
+
+    def test_transfer_invalidates_both_sides(self):
+        merchant_url = f"/api/merchants/{self.merchant.id}/"
+        self.get()
+        self.get(merchant_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            services.transfer(self.customer.id, self.merchant.id, 30)
+        self.assertEqual(self.get().json()["balance"], 70)
+        self.assertEqual(self.get(merchant_url).json()["balance"], 30)
+
+    def test_user_save_invalidates(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = "renamed"
+            self.user.save()
+        self.assertEqual(self.get().json()["user"]["username"], "renamed")
+
+    def test_delete_invalidates(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.client.force_login(services.create_account("admin", "password", is_superuser=True))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+@override_settings(EXPORT_CHUNK_SIZE=3)
+class ListPaginationTest(CacheClearingTestCase):
+    def test_empty_lists_are_204(self):
+        for params in ({}, {"page_size": 2}, {"export": "ndjson"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/api/customers/", params).status_code, 204)
+
+    def test_cursor_pages_cover_every_row_once(self):
+        ids = [user.customer.id for user in create_customers(7)]
+        seen, url = [], "/api/customers/?page_size=3"
+        while url:
+            page = self.client.get(url).json()
+            seen += [customer["id"] for customer in page["results"]]
+            url = page["next"]
+        self.assertEqual(seen, ids)
+
+        page = self.client.get("/api/customers/", {"page_size": 3, "ordering": "-id"}).json()
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([customer["id"] for customer in page["results"]], ids[3:0:-1])
+        previous = self.client.get(page["previous"]).json()
+        self.assertEqual([customer["id"] for customer in previous["results"]], ids[:3:-1])
+
+    def test_ndjson_export_streams_every_row(self):
+        ids = [user.customer.id for user in create_customers(7)]
+        response = self.client.get("/api/customers/", {"export": "ndjson", "fields": "id"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"id": customer_id} for customer_id in ids])
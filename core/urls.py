@@ -1,10 +1,20 @@
 from django.urls import path
-from core import merchant_views, customer_views
+from core import merchant_views, customer_views, account_views, async_views, stats_views
 
 urlpatterns = [
     path('merchants/', merchant_views.MerchantList.as_view()),
     path('merchants/<int:pk>/', merchant_views.MerchantDetail.as_view()),
+    path('merchants/<int:pk>/transactions/', merchant_views.MerchantTransactionList.as_view()),
+    path('accounts/bulk/', account_views.AccountBulkCreate.as_view()),
     path('customers/', customer_views.CustomerList.as_view()),
     path('customers/<int:pk>/', customer_views.CustomerDetail.as_view()),
-    path('transaction/<int:merc_id>/<int:price>/', customer_views.CustomerBuy.as_view())
+    path('customers/<int:pk>/transactions/', customer_views.CustomerTransactionList.as_view()),
+    path('transaction/<int:merc_id>/<int:price>/', customer_views.CustomerBuy.as_view()),
+    path('transactions/', customer_views.CustomerPurchase.as_view()),
+    path('transactions/bulk/', customer_views.CustomerBulkBuy.as_view()),
+    path('stats/', stats_views.Stats.as_view()),
+    path('async/merchants/', async_views.AsyncMerchantList.as_view()),
+    path('async/merchants/<int:pk>/', async_views.AsyncMerchantDetail.as_view()),
+    path('async/customers/', async_views.AsyncCustomerList.as_view()),
+    path('async/customers/<int:pk>/', async_views.AsyncCustomerDetail.as_view()),
 ]